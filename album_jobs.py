@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+from collections import namedtuple
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Albums processed at the same time across all users
+bot_job_workers = int(os.getenv('BOT_JOB_WORKERS', '2'))
+
+# size_policy is a photo_sizes.SizePolicy, None for the default one
+AlbumJob = namedtuple('AlbumJob', ['album_url', 'chat_id', 'context', 'size_policy'],
+                      defaults=(None,))
+
+
+class AlbumJobQueue:
+    """
+    Background queue for album jobs with a global concurrency cap
+
+    Handlers only enqueue a job and return, so the event loop stays free for
+    other users while a fixed number of workers run the jobs.
+
+    With a key function, jobs with the same key are single-flight: a job that
+    arrives while an identical one is queued or running is not run again, it
+    gets the first job's result through share(job, result) when that finishes.
+    handler(job) returns the result to share.
+    """
+
+    def __init__(self, handler, workers=None, key=None, share=None):
+        self.handler = handler
+        self.workers = workers or bot_job_workers
+        self.key = key
+        self.share = share
+        self._queue = None
+        self._tasks = []
+        # key -> jobs waiting on one execution, the one that runs comes first
+        self._inflight = {}
+        self.running = 0
+
+    def start(self):
+        """Start the workers, must be called from the running event loop"""
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job):
+        """
+        Enqueue a job
+
+        Returns:
+            the number of jobs waiting ahead of it, None if it joined an
+            identical job that is already queued or running
+        """
+        if self.key:
+            key = self.key(job)
+            if key in self._inflight:
+                self._inflight[key].append(job)
+                metrics.jobs_shared.inc()
+                return None
+            self._inflight[key] = [job]
+        ahead = self._queue.qsize()
+        await self._queue.put(job)
+        metrics.jobs_queued.set(self._queue.qsize())
+        return ahead
+
+    def pending(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self.running += 1
+            metrics.jobs_queued.set(self._queue.qsize())
+            metrics.jobs_running.set(self.running)
+            started = time.monotonic()
+            status = 'ok'
+            result = None
+            try:
+                result = await self.handler(job)
+            except Exception as e:
+                status = 'failed'
+                print(f'❌ Error in album job {job.album_url}: {e}')
+            finally:
+                # Nothing can join once the key is gone, so no follower is missed
+                followers = self._inflight.pop(self.key(job), [job])[1:] if self.key else []
+                self.running -= 1
+                metrics.jobs_running.set(self.running)
+                metrics.job_seconds.observe(time.monotonic() - started, status=status)
+                self._queue.task_done()
+            for follower in followers:
+                try:
+                    await self.share(follower, result)
+                except Exception as e:
+                    print(f'❌ Error sharing album job {job.album_url}: {e}')
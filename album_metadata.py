@@ -0,0 +1,78 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Owners whose albums are resolved at the same time
+metadata_workers = int(os.getenv('VK_METADATA_WORKERS', '4'))
+
+# (owner_id, album_id) -> album info from photos.getAlbums, kept for the whole run
+_album_cache = {}
+
+
+def _album_key(owner_id, album_id):
+    return str(owner_id), str(album_id)
+
+
+def _fetch_owner_albums(api, owner_id, album_ids):
+    """Resolve all requested albums of one owner with a single photos.getAlbums call"""
+    albums = api.photos.getAlbums(owner_id=owner_id,
+                                  album_ids=','.join(album_ids))['items']
+    return {_album_key(album['owner_id'], album['id']): album for album in albums}
+
+
+def prefetch_albums(api, queries, workers=None, refresh=False):
+    """
+    Resolve titles and sizes for all parsed queries up front
+
+    Queries are grouped by owner_id, each group costs one photos.getAlbums call
+    and the groups are fetched in parallel. Already cached albums are skipped,
+    unless refresh asks for their current `updated` / `size`.
+
+    Returns:
+        dict (owner_id, album_id) -> album info for every album that was found
+    """
+    groups = defaultdict(list)
+    for q in queries:
+        key = _album_key(q['owner_id'], q['album_id'])
+        if refresh:
+            _album_cache.pop(key, None)
+        if key not in _album_cache and key[1] not in groups[key[0]]:
+            groups[key[0]].append(key[1])
+
+    if groups:
+        with ThreadPoolExecutor(max_workers=workers or metadata_workers) as executor:
+            futures = [executor.submit(_fetch_owner_albums, api, owner_id, album_ids)
+                       for owner_id, album_ids in groups.items()]
+            for future in futures:
+                _album_cache.update(future.result())
+
+    return {key: _album_cache[key]
+            for key in (_album_key(q['owner_id'], q['album_id']) for q in queries)
+            if key in _album_cache}
+
+
+def list_owner_albums(api, owner_id):
+    """Return all albums of an owner with one photos.getAlbums call, caching them for the run"""
+    albums = api.photos.getAlbums(owner_id=owner_id)['items']
+    for album in albums:
+        _album_cache[_album_key(album['owner_id'], album['id'])] = album
+    return albums
+
+
+def get_album(api, owner_id, album_id, refresh=False):
+    """
+    Return album info from the run cache, fetching it if needed (None if not found)
+
+    refresh fetches it again, for long-running processes that need the current
+    `updated` / `size`; later calls get the refreshed copy.
+    """
+    key = _album_key(owner_id, album_id)
+    if refresh:
+        _album_cache.pop(key, None)
+    if key not in _album_cache:
+        _album_cache.update(_fetch_owner_albums(api, key[0], [key[1]]))
+    return _album_cache.get(key)
@@ -0,0 +1,391 @@
+"""
+Local stand-ins for VK API, the VK photo CDN and the Yandex Disk REST API
+
+Each service is a threaded HTTP/1.1 server on 127.0.0.1 that keeps just
+enough state for the album_downloader workflows and counts every call.
+"""
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, quote
+
+FAKE_OWNER_ID = -1
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class):
+        super().__init__(('127.0.0.1', 0), handler_class)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.calls = Counter()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def iter_body(self, chunk_size=64 * 1024):
+        """Yield the request body piece by piece, chunked or not"""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            chunk = self.rfile.read(min(remaining, chunk_size))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+    def read_body(self):
+        return b''.join(self.iter_body())
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# --- VK API -----------------------------------------------------------------
+
+def photo_url(cdn_url, album_id, photo_id):
+    return '{}/photos/{}/{}.jpg'.format(cdn_url, album_id, photo_id)
+
+
+def fake_photo(cdn_url, album_id, photo_id):
+    return {
+        'id': photo_id,
+        'album_id': album_id,
+        'owner_id': FAKE_OWNER_ID,
+        'sizes': [
+            {'type': 'x', 'width': 604, 'height': 403,
+             'url': photo_url(cdn_url, album_id, photo_id) + '?size=x'},
+            {'type': 'w', 'width': 2560, 'height': 1707,
+             'url': photo_url(cdn_url, album_id, photo_id)},
+        ],
+    }
+
+
+class VkHandler(Handler):
+    """
+    Fake https://api.vk.com/method/<name>
+
+    The album id doubles as its photo count, so album 1000 has 1000 photos.
+    """
+
+    def do_POST(self):
+        method = urlsplit(self.path).path.rsplit('/', 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(self.read_body().decode()).items()}
+        self.server.count(method)
+        handler = getattr(self, 'method_' + method.replace('.', '_'), None)
+        if handler is None:
+            self.send_json(200, {'error': {'error_code': 3, 'error_msg': 'Unknown method',
+                                           'request_params': []}})
+            return
+        self.send_json(200, {'response': handler(params)})
+
+    do_GET = do_POST
+
+    def method_users_get(self, params):
+        return [{'id': 1, 'first_name': 'Bench', 'last_name': 'User'}]
+
+    def album(self, owner_id, album_id):
+        return {'id': int(album_id), 'owner_id': int(owner_id), 'size': int(album_id),
+                'title': 'Bench album {}'.format(album_id), 'updated': 0}
+
+    def method_photos_getAlbums(self, params):
+        owner_id = params.get('owner_id', FAKE_OWNER_ID)
+        if 'album_ids' in params:
+            ids = params['album_ids'].split(',')
+        else:
+            ids = [str(size) for size in self.server.album_sizes]
+        items = [self.album(owner_id, i) for i in ids]
+        offset = int(params.get('offset', 0))
+        count = int(params.get('count', len(items)))
+        return {'count': len(items), 'items': items[offset:offset + count]}
+
+    def photos_page(self, album_id, offset, count):
+        total = int(album_id)
+        items = [fake_photo(self.server.cdn_url, int(album_id), photo_id)
+                 for photo_id in range(offset + 1, min(offset + count, total) + 1)]
+        return {'count': total, 'items': items}
+
+    def method_photos_get(self, params):
+        return self.photos_page(params['album_id'], int(params.get('offset', 0)),
+                                min(int(params.get('count', 50)), 1000))
+
+    def method_execute(self, params):
+        """Understands the photo listing script of vk_photos.list_photos_code"""
+        code = params['code']
+        album_id = re.search(r'var album_id = (-?\d+);', code).group(1)
+        offset = int(re.search(r'var offset = (\d+);', code).group(1))
+        pages = int(re.search(r'while \(i < (\d+)', code).group(1))
+        page_size = int(re.search(r'offset = offset \+ (\d+);', code).group(1))
+        count = offset + 1
+        result = []
+        for _ in range(pages):
+            if offset >= count:
+                break
+            page = self.photos_page(album_id, offset, page_size)
+            # Each photos.get inside execute still counts against VK's limits
+            self.server.count('execute.photos.get')
+            count = page['count']
+            result.append(page['items'])
+            offset += page_size
+        return {'count': count, 'pages': result}
+
+
+def fake_vk(cdn_url, album_sizes):
+    server = FakeServer(VkHandler)
+    server.cdn_url = cdn_url
+    server.album_sizes = album_sizes
+    return server
+
+
+# --- Photo CDN --------------------------------------------------------------
+
+class CdnHandler(Handler):
+    """Serves deterministic photo bytes with configurable latency and bandwidth"""
+
+    def photo_bytes(self):
+        seed = urlsplit(self.path).path.encode()
+        size = self.server.photo_size
+        return (seed * (size // len(seed) + 1))[:size]
+
+    def do_GET(self):
+        self.server.count('photo')
+        time.sleep(self.server.latency)
+        body = self.photo_bytes()
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match and int(match.group(1)) < len(body):
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+
+        chunk_size = 64 * 1024
+        for offset in range(start, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            self.wfile.write(chunk)
+            with self.server.lock:
+                self.server.bytes_sent += len(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+
+
+def fake_cdn(photo_size, latency, bandwidth):
+    """
+    Args:
+        photo_size: bytes per photo
+        latency: seconds before the first byte of every response
+        bandwidth: bytes per second per connection, 0 for unlimited
+    """
+    server = FakeServer(CdnHandler)
+    server.photo_size = photo_size
+    server.latency = latency
+    server.bandwidth = bandwidth
+    server.bytes_sent = 0
+    return server
+
+
+# --- Yandex Disk REST API ---------------------------------------------------
+
+def disk_path(path):
+    path = path[len('disk:'):] if path.startswith('disk:') else path
+    return '/' + path.strip('/')
+
+
+class YandexHandler(Handler):
+    """Fake https://cloud-api.yandex.net/v1/disk with an in-memory file tree"""
+
+    def route(self, method):
+        parts = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        name = '{} {}'.format(method, parts.path)
+        handler = {
+            'GET /v1/disk': self.disk_info,
+            'GET /v1/disk/': self.disk_info,
+            'GET /v1/disk/resources': self.get_meta,
+            'PUT /v1/disk/resources': self.mkdir,
+            'GET /v1/disk/resources/upload': self.upload_link,
+            'PUT /upload': self.upload,
+            'POST /v1/disk/resources/copy': self.copy,
+            'PUT /v1/disk/resources/publish': self.publish,
+        }.get(name)
+        if name.startswith('GET /v1/disk/operations/'):
+            handler = self.operation_status
+        self.server.count('upload' if parts.path == '/upload' else name)
+        if handler is None:
+            self.send_json(404, {'error': 'NotFoundError', 'description': name})
+        else:
+            handler(params)
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def not_found(self, path):
+        self.send_json(404, {'error': 'DiskNotFoundError',
+                             'description': 'Resource not found: {}'.format(path)})
+
+    def link(self, path):
+        return {'href': '{}/v1/disk/resources?path={}'.format(self.server.url, quote(path)),
+                'method': 'GET', 'templated': False}
+
+    def resource(self, path):
+        files = self.server.files
+        dirs = self.server.dirs
+        name = path.rsplit('/', 1)[-1]
+        if path in files:
+            size, md5 = files[path]
+            return {'type': 'file', 'name': name, 'path': 'disk:' + path, 'size': size,
+                    'md5': md5, 'mime_type': 'image/jpeg',
+                    'public_url': self.server.public.get(path)}
+        if path in dirs:
+            return {'type': 'dir', 'name': name, 'path': 'disk:' + path,
+                    'public_url': self.server.public.get(path)}
+        return None
+
+    def operation_status(self, params):
+        # yadisk's check_token() asks for a made-up operation and expects exactly this
+        self.send_json(404, {'error': 'DiskOperationNotFoundError',
+                             'description': 'Operation not found'})
+
+    def disk_info(self, params):
+        self.send_json(200, {'total_space': 10 ** 12, 'used_space': 0, 'trash_size': 0})
+
+    def get_meta(self, params):
+        path = disk_path(params['path'])
+        with self.server.lock:
+            meta = self.resource(path)
+            if meta is None:
+                self.not_found(path)
+                return
+            if meta['type'] == 'dir':
+                prefix = path.rstrip('/') + '/'
+                children = sorted(p for p in list(self.server.files) + list(self.server.dirs)
+                                  if p.startswith(prefix) and '/' not in p[len(prefix):])
+                offset = int(params.get('offset', 0))
+                limit = int(params.get('limit', 20))
+                meta['_embedded'] = {
+                    'items': [self.resource(p) for p in children[offset:offset + limit]],
+                    'offset': offset, 'limit': limit, 'total': len(children),
+                    'path': 'disk:' + path,
+                }
+        self.send_json(200, meta)
+
+    def mkdir(self, params):
+        path = disk_path(params['path'])
+        with self.server.lock:
+            if path in self.server.dirs:
+                self.send_json(409, {'error': 'DiskPathPointsToExistentDirectoryError',
+                                     'description': 'Directory exists: {}'.format(path)})
+                return
+            self.server.dirs.add(path)
+        self.send_json(201, self.link(path))
+
+    def upload_link(self, params):
+        path = disk_path(params['path'])
+        self.send_json(200, {'href': '{}/upload?path={}'.format(self.server.url, quote(path)),
+                             'method': 'PUT', 'templated': False,
+                             'operation_id': 'upload'})
+
+    def upload(self, params):
+        # Hashed as it arrives, a whole archive in memory would skew the RSS report
+        md5 = hashlib.md5()
+        size = 0
+        for chunk in self.iter_body():
+            md5.update(chunk)
+            size += len(chunk)
+        path = disk_path(params['path'])
+        with self.server.lock:
+            self.server.files[path] = (size, md5.hexdigest())
+            self.server.bytes_received += size
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def copy(self, params):
+        source = disk_path(params['from'])
+        path = disk_path(params['path'])
+        with self.server.lock:
+            if source not in self.server.files:
+                self.not_found(source)
+                return
+            self.server.files[path] = self.server.files[source]
+        self.send_json(201, self.link(path))
+
+    def publish(self, params):
+        path = disk_path(params['path'])
+        with self.server.lock:
+            self.server.public[path] = '{}/public{}'.format(self.server.url, quote(path))
+        self.send_json(200, self.link(path))
+
+
+def fake_yandex_disk():
+    server = FakeServer(YandexHandler)
+    server.files = {}
+    server.dirs = {'/'}
+    server.public = {}
+    server.bytes_received = 0
+
+    reset_calls = server.reset
+
+    def reset():
+        reset_calls()
+        with server.lock:
+            server.files = {}
+            server.dirs = {'/'}
+            server.public = {}
+            server.bytes_received = 0
+
+    server.reset = reset
+    return server
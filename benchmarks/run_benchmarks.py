@@ -0,0 +1,267 @@
+"""
+Offline throughput benchmark for album_downloader
+
+Runs the CLI workflow (main.sync_albums, main.download_albums when streaming,
+download + archive upload with ARCHIVE_MODE=zip) and the Telegram bot workflow against local fake VK / CDN / Yandex Disk
+servers and reports photos/sec, MB/s, API calls per album and peak RSS.
+
+Usage:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10,100 --latency-ms 20 --save results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from fake_services import fake_vk, fake_cdn, fake_yandex_disk, FAKE_OWNER_ID
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+yandex_disk_path = '/Bench'
+
+
+def install_routes(routes):
+    """Send requests for the real API hosts to the local fakes instead"""
+    from requests.adapters import HTTPAdapter
+
+    original_send = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        if parts.hostname in routes:
+            request.url = routes[parts.hostname] + parts.path + (
+                '?' + parts.query if parts.query else '')
+        return original_send(self, request, **kwargs)
+
+    HTTPAdapter.send = send
+
+
+def album_url(size):
+    return 'https://vk.com/album{}_{}'.format(FAKE_OWNER_ID, size)
+
+
+# --- child process: runs one workload and reports timings ---------------------
+
+def run_cli(size, scenario):
+    with open(os.environ['ALBUMS_LIST_PATH'], 'w') as f:
+        f.write(album_url(size) + '\n')
+
+    import main
+
+    started = time.perf_counter()
+    if scenario == 'cli-stream':
+        ok = main.download_albums(stream_to=yandex_disk_path)
+    elif scenario == 'cli-archive':
+        # Same as main.main with ARCHIVE_MODE: whole albums first, then one archive each
+        ok = (main.download_albums(archive_to=yandex_disk_path)
+              and main.upload_albums_to_yandex_disk(yandex_disk_path))
+    else:
+        # Same as main.main: list / download / upload stages overlap across albums
+        ok = main.sync_albums(yandex_disk_path)
+    finished = time.perf_counter()
+    return {'ok': ok, 'total_s': finished - started}
+
+
+class FakeBot:
+    """Accepts whatever the bot sends, so the workflow runs without Telegram"""
+
+    def __init__(self):
+        self.messages = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages += 1
+        return SimpleNamespace(message_id=self.messages)
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+def run_bot(size):
+    import telegram_bot
+    from album_jobs import AlbumJob
+
+    context = SimpleNamespace(bot=FakeBot())
+    started = time.perf_counter()
+    result = asyncio.run(telegram_bot.process_album_job(AlbumJob(album_url(size), 1, context)))
+    finished = time.perf_counter()
+    # process_album_job returns its final message only when the workflow succeeded
+    return {'ok': result is not None, 'total_s': finished - started,
+            'messages': context.bot.messages}
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process alone
+
+    ru_maxrss survives exec on Linux, so a child would report the parent's peak
+    (the fakes); VmHWM belongs to the current address space only.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child_main(scenario, size):
+    sys.path.insert(0, repo_root)
+    install_routes(json.loads(os.environ['BENCH_ROUTES']))
+    # Workflow output would drown the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        if scenario == 'bot':
+            result = run_bot(size)
+        else:
+            result = run_cli(size, scenario)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+# --- parent process: runs the fakes and collects the report -------------------
+
+def run_one(scenario, size, services, args):
+    vk, cdn, yandex = services
+    for server in services:
+        server.reset()
+    cdn.bytes_sent = 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ,
+                   VK_ACCESS_TOKEN='bench', YANDEX_DISK_TOKEN='bench',
+                   YANDEX_DISK_PATH=yandex_disk_path,
+                   STATE_DB_PATH=os.path.join(workdir, 'state.sqlite3'),
+                   ALBUMS_LIST_PATH=os.path.join(workdir, 'albums.txt'),
+                   STREAMING_MODE='1' if scenario == 'cli-stream' else '0',
+                   ARCHIVE_MODE='zip' if scenario == 'cli-archive' else '',
+                   VK_REQUESTS_PER_SECOND=str(args.vk_rps),
+                   VK_BURST=str(max(int(args.vk_rps), 1)),
+                   BENCH_ROUTES=json.dumps({'api.vk.com': vk.url, 'api.vk.ru': vk.url,
+                                            'cloud-api.yandex.net': yandex.url}))
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', scenario, str(size)],
+            cwd=workdir, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError('{} / {} photos failed:\n{}'.format(scenario, size, process.stderr))
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    total = result['total_s']
+    result.update({
+        'scenario': scenario,
+        'photos': size,
+        'photos_per_s': size / total if total else 0,
+        'mb_per_s': cdn.bytes_sent / 2 ** 20 / total if total else 0,
+        'vk_calls': sum(vk.calls.values()),
+        'yandex_calls': sum(n for name, n in yandex.calls.items() if name != 'upload'),
+        'uploads': yandex.calls['upload'],
+    })
+    # A fast run that didn't upload everything measures nothing
+    expected_uploads = 1 if scenario == 'cli-archive' else size
+    if not result['ok'] or result['uploads'] != expected_uploads:
+        raise RuntimeError('{} / {} photos failed: ok={}, {} upload(s)'.format(
+            scenario, size, result['ok'], result['uploads']))
+    return result
+
+
+def print_report(results):
+    header = '{:<11} {:>7} {:>9} {:>10} {:>8} {:>9} {:>13} {:>9} {:>9}'.format(
+        'scenario', 'photos', 'time, s', 'photos/s', 'MB/s', 'VK calls',
+        'Yandex calls', 'uploads', 'RSS, MB')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print('{:<11} {:>7} {:>9.2f} {:>10.1f} {:>8.1f} {:>9} {:>13} {:>9} {:>9.1f}'.format(
+            r['scenario'], r['photos'], r['total_s'], r['photos_per_s'], r['mb_per_s'],
+            r['vk_calls'], r['yandex_calls'], r['uploads'], r['peak_rss_mb']))
+
+
+def find_regressions(results, baseline, tolerance):
+    """Return descriptions of runs that got slower than baseline by more than tolerance"""
+    previous = {(r['scenario'], r['photos']): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r['scenario'], r['photos']))
+        if old and r['photos_per_s'] < old['photos_per_s'] * (1 - tolerance):
+            regressions.append('{} / {} photos: {:.1f} photos/s, was {:.1f}'.format(
+                r['scenario'], r['photos'], r['photos_per_s'], old['photos_per_s']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma separated album sizes (photos)')
+    parser.add_argument('--scenarios', default='cli,cli-stream,cli-archive,bot',
+                        help='comma separated: cli, cli-stream, cli-archive, bot')
+    parser.add_argument('--photo-kb', type=int, default=200, help='size of every photo')
+    parser.add_argument('--latency-ms', type=float, default=50,
+                        help='CDN time to first byte')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                        help='CDN bandwidth per connection in megabits, 0 for unlimited')
+    parser.add_argument('--vk-rps', type=float, default=3,
+                        help='VK request budget handed to the workflow')
+    parser.add_argument('--save', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed photos/s drop against the baseline (0.2 = 20%%)')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args.child[0], int(args.child[1]))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    scenarios = args.scenarios.split(',')
+
+    cdn = fake_cdn(args.photo_kb * 1024, args.latency_ms / 1000,
+                   args.bandwidth_mbps * 10 ** 6 / 8).start()
+    vk = fake_vk(cdn.url, sizes).start()
+    yandex = fake_yandex_disk().start()
+    services = (vk, cdn, yandex)
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for size in sizes:
+                results.append(run_one(scenario, size, services, args))
+    finally:
+        for server in services:
+            server.stop()
+
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print()
+            print('✗ Throughput regressions:')
+            for line in regressions:
+                print(line)
+            sys.exit(1)
+        print()
+        print('✓ No throughput regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+import vk_api
+import yadisk
+from dotenv import load_dotenv
+
+from get_vk_session import get_vk_session
+
+# Load environment variables
+load_dotenv()
+
+# Seconds a successful token check is trusted before the next one
+token_check_ttl = float(os.getenv('TOKEN_CHECK_TTL', '3600'))
+
+# VK error code for a revoked or expired access token
+vk_auth_error_code = 5
+
+
+class ClientRegistry:
+    """
+    Process-wide VK and Yandex Disk clients
+
+    Each client (and its HTTP session) is created once. Tokens are checked on
+    first use and then only when the TTL expires or after an auth error.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = token_check_ttl if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._vk_api = None
+        self._vk_checked = None
+        self._yandex_disk = None
+        self._yandex_checked = None
+
+    def _is_stale(self, checked):
+        return checked is None or time.monotonic() - checked > self.ttl
+
+    def vk_api(self):
+        """Return VK API, raises if the token doesn't work"""
+        with self._lock:
+            if self._vk_api is None:
+                self._vk_api = get_vk_session().get_api()
+            if self._is_stale(self._vk_checked):
+                # Test the API connection
+                self._vk_api.users.get(user_ids=1)
+                self._vk_checked = time.monotonic()
+            return self._vk_api
+
+    def yandex_disk(self):
+        """Return Yandex Disk client, raises ValueError if the token is missing or invalid"""
+        with self._lock:
+            if self._yandex_disk is None:
+                token = os.getenv('YANDEX_DISK_TOKEN')
+                if not token:
+                    raise ValueError('Yandex Disk token not configured')
+                self._yandex_disk = yadisk.YaDisk(token=token)
+            if self._is_stale(self._yandex_checked):
+                if not self._yandex_disk.check_token():
+                    raise ValueError('Invalid Yandex Disk token')
+                self._yandex_checked = time.monotonic()
+            return self._yandex_disk
+
+    def report_error(self, error):
+        """Force a token re-check on next use if error is an auth failure"""
+        with self._lock:
+            if isinstance(error, vk_api.exceptions.ApiError) and error.code == vk_auth_error_code:
+                self._vk_checked = None
+            elif isinstance(error, yadisk.exceptions.UnauthorizedError):
+                self._yandex_checked = None
+
+
+clients = ClientRegistry()
@@ -0,0 +1,73 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Number of photos downloaded at the same time
+download_workers = int(os.getenv('DOWNLOAD_WORKERS', '16'))
+# Max simultaneous connections to a single CDN host
+download_per_host_limit = int(os.getenv('DOWNLOAD_PER_HOST_LIMIT', '8'))
+
+DownloadTask = namedtuple('DownloadTask', ['url', 'path'])
+
+
+class DownloadEngine:
+    """Downloads photos with a bounded worker pool and a per-host connection limit"""
+
+    def __init__(self, download_func, workers=None, per_host_limit=None):
+        self.download_func = download_func
+        self.workers = workers or download_workers
+        self.per_host_limit = per_host_limit or download_per_host_limit
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def run(self, task):
+        """Download one task under the per-host limit, for callers with their own workers"""
+        with self._host_semaphore(task.url):
+            return self.download_func(task.url, task.path)
+
+    def download(self, tasks, progress=None):
+        """
+        Download all tasks concurrently
+
+        Args:
+            tasks: list of DownloadTask
+            progress: optional callback progress(done, total), always called from
+                the calling thread with a strictly increasing done counter
+
+        Returns:
+            list of download_func results in the same order as tasks
+            (False for tasks that raised an exception)
+        """
+        results = [False] * len(tasks)
+        if not tasks:
+            return results
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.run, task): i
+                       for i, task in enumerate(tasks)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    print(f'\nError downloading {tasks[i].url}: {e}')
+                done += 1
+                if progress:
+                    progress(done, len(tasks))
+        return results
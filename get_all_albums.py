@@ -1,4 +1,12 @@
-from get_vk_session import get_vk_session
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from clients import clients
+
+# Load environment variables
+load_dotenv()
 
 bu_names = ['БЮ', 'Bauman United', 'Бауман Юнайтед', 'BU']
 bauman_owners_ids = [-126910967, -76322058]
@@ -7,36 +15,109 @@ ext_bu_names = ['БЮ', 'Bauman United', 'Бауман Юнайтед', 'Бау
 # TODO Убрать альбомы аматорки
 owner_ids = [-210711661, -118390813, -219138822, -119296549]
 
+path_to_albums_list = 'albums_list.txt'
+# Only albums that are new or changed since the previous run
+path_to_albums_delta = 'albums_delta.txt'
+# updated / size of every album as of its last successful sync
+path_to_albums_snapshot = 'albums_snapshot.json'
+# updated / size of discovered albums that main.py has not synced yet
+path_to_albums_pending = 'albums_pending.json'
 
-def get_all_albums():
-    vk_session = get_vk_session()
-    api = vk_session.get_api()
-    vk_session._auth_token()
-    token = vk_session.token['access_token']
-    all_albums_ids = []
-
-    for bauman_owner in bauman_owners_ids:
-        all_albums = api.photos.getAlbums(access_token=token, owner_id=bauman_owner)['items']
-        bu_albums = list(filter(lambda x: any(name in x['title'] for name in bu_names), all_albums))
-        for a in bu_albums:
-            all_albums_ids.append('https://vk.com/album' + str(a['owner_id']) + '_' + str(a['id']))
-
-    for owner in owner_ids:
-        all_albums = api.photos.getAlbums(access_token=token, owner_id=owner)['items']
-        bu_albums = list(filter(lambda x: any(name in x['title'] for name in ext_bu_names), all_albums))
-        for a in bu_albums:
-            all_albums_ids.append('https://vk.com/album' + str(a['owner_id']) + '_' + str(a['id']))
-
-    with open('albums_list.txt', 'w+') as f:
+# Owners queried at the same time
+discovery_workers = int(os.getenv('VK_DISCOVERY_WORKERS', '4'))
+# photos.getAlbums page size
+albums_page_size = 100
+
+
+def album_url(album):
+    return 'https://vk.com/album' + str(album['owner_id']) + '_' + str(album['id'])
+
+
+def get_owner_albums(api, owner_id):
+    """Page through all albums of an owner"""
+    albums = []
+    while True:
+        response = api.photos.getAlbums(owner_id=owner_id, offset=len(albums),
+                                        count=albums_page_size)
+        albums.extend(response['items'])
+        if not response['items'] or len(albums) >= response['count']:
+            return albums
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def commit_snapshot(urls):
+    """
+    Advance the snapshot of albums that main.py has synced
+
+    Until then they keep their old entry, so a failed or skipped sync leaves
+    them in the next delta.
+    """
+    pending = read_json(path_to_albums_pending)
+    synced = [url for url in urls if url in pending]
+    if not synced:
+        return
+    snapshot = read_json(path_to_albums_snapshot)
+    for url in synced:
+        snapshot[url] = pending.pop(url)
+    write_json(path_to_albums_snapshot, snapshot)
+    write_json(path_to_albums_pending, pending)
+
+
+def write_list(path, urls):
+    with open(path, 'w+') as f:
         # write elements of list
-        for a in all_albums_ids:
-            f.write('%s\n' % a)
+        for url in urls:
+            f.write('%s\n' % url)
+
+
+def get_all_albums():
+    api = clients.vk_api()
+
+    # (owner_id, title filter) for every owner to scan
+    owners = [(owner, bu_names) for owner in bauman_owners_ids]
+    owners += [(owner, ext_bu_names) for owner in owner_ids]
+
+    with ThreadPoolExecutor(max_workers=discovery_workers) as executor:
+        owner_albums = list(executor.map(lambda o: get_owner_albums(api, o[0]), owners))
+
+    bu_albums = []
+    for (owner, names), all_albums in zip(owners, owner_albums):
+        bu_albums += list(filter(lambda x: any(name in x['title'] for name in names), all_albums))
 
-        print("File written successfully")
+    # Compare with the last sync to find new or changed albums; the snapshot
+    # itself only moves on once main.py has synced them (commit_snapshot)
+    old_snapshot = read_json(path_to_albums_snapshot)
+    snapshot = {}
+    pending = {}
+    for a in bu_albums:
+        url = album_url(a)
+        state = {'updated': a.get('updated'), 'size': a.get('size')}
+        if url in old_snapshot:
+            snapshot[url] = old_snapshot[url]
+        if old_snapshot.get(url) != state:
+            pending[url] = state
 
-    # close the file
-    f.close()
+    urls = [album_url(a) for a in bu_albums]
+    write_list(path_to_albums_list, dict.fromkeys(urls))
+    write_list(path_to_albums_delta, pending)
+    write_json(path_to_albums_snapshot, snapshot)
+    write_json(path_to_albums_pending, pending)
 
+    print("File written successfully")
+    print('{} album(s) found, {} new or changed'.format(len(set(urls)), len(pending)))
 
 
-get_all_albums()
\ No newline at end of file
+if __name__ == "__main__":
+    get_all_albums()
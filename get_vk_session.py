@@ -1,8 +1,9 @@
-import vk_api
 import sys
 import os
 from dotenv import load_dotenv
 
+from vk_rate_limit import RateLimitedVkApi
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -46,6 +47,7 @@ def get_vk_session():
     
     # l, p = get_user_data()
     # vk_session = vk_api.VkApi(l, p, captcha_handler=handler_captcha, app_id=71697589)
-    vk_session = vk_api.VkApi(token=access_token)
+    # Rate-limited session: all VK calls of the process share one request budget
+    vk_session = RateLimitedVkApi(token=access_token)
     return vk_session
 
@@ -0,0 +1,206 @@
+import os
+import hashlib
+import threading
+from collections import namedtuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+import metrics
+from download_engine import download_workers
+
+# Load environment variables
+load_dotenv()
+
+# Size of a single read from the response body (default: 1 MiB)
+download_chunk_size = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))
+# Seconds to wait for connect / for the next chunk of data
+download_timeout = float(os.getenv('DOWNLOAD_TIMEOUT', '30'))
+# How many times a transient failure is retried before giving up
+download_retries = int(os.getenv('DOWNLOAD_RETRIES', '3'))
+
+# Unfinished downloads are kept under this suffix until they are complete
+part_suffix = '.part'
+
+
+class IncompleteDownloadError(IOError):
+    """Body ended before Content-Length bytes were received"""
+
+
+# Errors worth retrying: the connection dropped or stalled mid-body
+transient_errors = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    IncompleteDownloadError,
+)
+
+DownloadResult = namedtuple('DownloadResult', ['size', 'md5', 'sha256'])
+
+
+class DownloadClient:
+    """Keep-alive HTTP client for photo downloads shared by all workers"""
+
+    def __init__(self, pool_size=None, chunk_size=None, timeout=None, retries=None):
+        self.pool_size = pool_size or download_workers
+        self.chunk_size = chunk_size or download_chunk_size
+        self.timeout = timeout or download_timeout
+        self.retries = download_retries if retries is None else retries
+
+        # Retry connection errors and throttling / 5xx answers at the transport level
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def download(self, url, local_file_name):
+        """
+        Download single image from URL, returns DownloadResult or False on failure
+
+        Data goes to a .part file first. A retry (or a later run) resumes it with
+        an HTTP Range request, and it is renamed to local_file_name only once its
+        size matches Content-Length.
+        """
+        part_file_name = local_file_name + part_suffix
+        with metrics.cdn_download_seconds.time():
+            for attempt in range(self.retries + 1):
+                try:
+                    result = self._download_part(url, part_file_name, local_file_name)
+                    break
+                except transient_errors as e:
+                    if attempt == self.retries:
+                        print(f'\nError downloading {url}: {e}')
+                        result = False
+                    else:
+                        metrics.retries.inc(stage='cdn')
+        metrics.transfers.inc(stage='cdn', status='ok' if result else 'failed')
+        return result
+
+    def _download_part(self, url, part_file_name, local_file_name):
+        offset = os.path.getsize(part_file_name) if os.path.exists(part_file_name) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        with self.session.get(url, stream=True, timeout=self.timeout,
+                              headers=headers) as response:
+            if response.status_code == 416:
+                # The .part file doesn't match the remote file anymore, start over
+                os.remove(part_file_name)
+                raise IncompleteDownloadError(f'stale partial download of {url}')
+            if not response.ok:
+                print('bad response:', response)
+                return False
+
+            md5 = hashlib.md5()
+            sha256 = hashlib.sha256()
+            if response.status_code == 206:
+                # Resuming: the checksums have to cover the bytes we already have
+                with open(part_file_name, 'rb') as file:
+                    for chunk in iter(lambda: file.read(self.chunk_size), b''):
+                        md5.update(chunk)
+                        sha256.update(chunk)
+                mode = 'ab'
+            else:
+                # Server ignored the Range header and sent the whole file
+                offset = 0
+                mode = 'wb'
+
+            expected_size = None
+            if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+                expected_size = offset + int(response.headers['Content-Length'])
+
+            size = offset
+            with open(part_file_name, mode) as file:
+                for chunk in response.iter_content(self.chunk_size):
+                    file.write(chunk)
+                    md5.update(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    metrics.transferred_bytes.inc(len(chunk), stage='cdn')
+
+        if expected_size is not None and size != expected_size:
+            raise IncompleteDownloadError(
+                f'got {size} of {expected_size} bytes from {url}')
+        os.replace(part_file_name, local_file_name)
+        return DownloadResult(size, md5.hexdigest(), sha256.hexdigest())
+
+    def open_stream(self, url):
+        """Open a streamed GET whose raw body can be read like a file, caller closes it"""
+        response = self.session.get(url, stream=True, timeout=self.timeout)
+        if not response.ok:
+            response.close()
+            response.raise_for_status()
+        response.raw.decode_content = True
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class HashingReader:
+    """
+    File-like wrapper that computes MD5 / SHA-256 of everything read through it
+
+    It is a forward-only stream: uploaders that check seekable() read it in
+    chunks instead of seeking to measure or replay it.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.md5.update(chunk)
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def result(self):
+        return DownloadResult(self.size, self.md5.hexdigest(), self.sha256.hexdigest())
+
+
+def file_hashes(path, chunk_size=None):
+    """Return DownloadResult with size and checksums of a local file"""
+    with open(path, 'rb') as file:
+        reader = HashingReader(file)
+        while reader.read(chunk_size or download_chunk_size):
+            pass
+    return reader.result()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_download_client():
+    """Return the process-wide download client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DownloadClient()
+    return _client
@@ -0,0 +1,172 @@
+import os
+import threading
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from http_client import file_hashes, part_suffix, DownloadResult
+
+# Pillow is only needed when recompression is switched on
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Load environment variables
+load_dotenv()
+
+# Target format of the recompression stage: jpeg or webp, empty to upload photos as fetched
+recompress_format = os.getenv('RECOMPRESS_FORMAT', '').lower()
+# Encoder quality, 1-100
+recompress_quality = int(os.getenv('RECOMPRESS_QUALITY', '85'))
+# Longest side in pixels after downscaling, 0 keeps the original resolution
+recompress_max_side = int(os.getenv('RECOMPRESS_MAX_SIDE', '0'))
+# Processes encoding at the same time (default: one per CPU core)
+recompress_workers = int(os.getenv('RECOMPRESS_WORKERS', '0')) or os.cpu_count()
+
+formats = {'jpeg': '.jpg', 'webp': '.webp'}
+
+# md5 / sha256 are None when the original file was kept as it is
+TransformResult = namedtuple('TransformResult',
+                             ['path', 'original_size', 'size', 'md5', 'sha256'])
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_process_pool(workers=None):
+    """Return the process-wide encoder pool, creating it on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: forking a process that runs threads and an event loop is unsafe
+            _executor = ProcessPoolExecutor(max_workers=workers or recompress_workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def transform_photo(path, image_format, quality, max_side):
+    """
+    Re-encode one photo in place, runs in a worker process
+
+    EXIF orientation is applied before metadata is dropped. The original is
+    kept when re-encoding would not make it smaller.
+    """
+    original_size = os.path.getsize(path)
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        new_path = os.path.splitext(path)[0] + formats[image_format]
+        # Not new_path + part_suffix: that is where a download of new_path would resume
+        tmp_path = new_path + '.recompress' + part_suffix
+        if image_format == 'jpeg':
+            image.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+        else:
+            image.save(tmp_path, 'WEBP', quality=quality, method=4)
+
+    if os.path.getsize(tmp_path) >= original_size and not max_side:
+        os.remove(tmp_path)
+        return TransformResult(path, original_size, original_size, None, None)
+
+    os.replace(tmp_path, new_path)
+    if new_path != path:
+        os.remove(path)
+    result = file_hashes(new_path)
+    return TransformResult(new_path, original_size, result.size, result.md5, result.sha256)
+
+
+class ImageTransformer:
+    """
+    Optional recompression stage between download and upload
+
+    Encoding is CPU bound, so it runs in a process pool that uses every core
+    while the download / upload thread pools keep doing I/O. The pool is shared
+    by the process; each transformer keeps its own total of bytes before and
+    after for the savings report.
+    """
+
+    def __init__(self, image_format=None, quality=None, max_side=None):
+        self.image_format = recompress_format if image_format is None else image_format
+        self.quality = quality or recompress_quality
+        self.max_side = recompress_max_side if max_side is None else max_side
+        if self.image_format and self.image_format not in formats:
+            raise ValueError('RECOMPRESS_FORMAT must be one of: ' + ', '.join(formats))
+        if self.image_format and Image is None:
+            print('⚠️ RECOMPRESS_FORMAT is set but Pillow is not installed, '
+                  'photos are uploaded as fetched (pip install Pillow)')
+            self.image_format = ''
+        self.original_bytes = 0
+        self.bytes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.image_format)
+
+    def transform(self, paths, progress=None):
+        """
+        Recompress all files concurrently
+
+        Args:
+            paths: local photo paths
+            progress: optional callback progress(done, total), always called from
+                the calling thread with a strictly increasing done counter
+
+        Returns:
+            list of TransformResult in the order of paths, None where it failed
+        """
+        results = [None] * len(paths)
+        if not paths:
+            return results
+        executor = get_process_pool()
+        futures = {executor.submit(transform_photo, path, self.image_format,
+                                         self.quality, self.max_side): i
+                   for i, path in enumerate(paths)}
+        done = 0
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+                self.original_bytes += results[i].original_size
+                self.bytes += results[i].size
+            except Exception as e:
+                # The original stays in place and is uploaded as it is
+                print(f'\nError recompressing {paths[i]}: {e}')
+            done += 1
+            if progress:
+                progress(done, len(paths))
+        return results
+
+    def transform_downloads(self, tasks, results, progress=None):
+        """
+        Recompress the photos of successful downloads
+
+        Args:
+            tasks: list of DownloadTask
+            results: DownloadEngine results for tasks (DownloadResult or False)
+            progress: optional callback progress(done, total)
+
+        Returns:
+            (tasks, results) with paths and checksums of the re-encoded files
+        """
+        downloaded = [i for i, result in enumerate(results) if result]
+        transformed = self.transform([tasks[i].path for i in downloaded], progress)
+        tasks = list(tasks)
+        results = list(results)
+        for i, result in zip(downloaded, transformed):
+            if result and result.md5:
+                tasks[i] = tasks[i]._replace(path=result.path)
+                results[i] = DownloadResult(result.size, result.md5, result.sha256)
+        return tasks, results
+
+    def report(self):
+        """One line with the bytes saved so far"""
+        saved = self.original_bytes - self.bytes
+        percent = saved * 100 / self.original_bytes if self.original_bytes else 0
+        return 'recompressed {:.1f} MB to {:.1f} MB, saved {:.1f} MB ({:.0f}%)'.format(
+            self.original_bytes / 2 ** 20, self.bytes / 2 ** 20, saved / 2 ** 20, percent)
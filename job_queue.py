@@ -0,0 +1,234 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import contextlib
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Album jobs shared by the bot front-end and the job_worker.py processes
+path_to_job_db = os.getenv('JOB_QUEUE_DB_PATH', 'album_jobs.sqlite3')
+# Seconds a worker owns a job without renewing it; after that the job is run again
+job_lease_seconds = float(os.getenv('JOB_LEASE_SECONDS', '120'))
+# Runs of a job before it is given up (a worker that dies or raises uses one up)
+job_max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# Seconds an idle worker waits before looking for a new job
+job_poll_interval = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL,
+    album_url TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    size_policy TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key, status);
+CREATE TABLE IF NOT EXISTS job_requesters (
+    job_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL
+);
+'''
+
+
+class JobStore:
+    """
+    Durable album job queue in SQLite, shared by the processes of one host
+
+    A worker leases a job and renews the lease while the job runs; when the
+    worker dies the lease runs out and another worker picks the job up again,
+    up to max_attempts runs. Jobs with the same key are single-flight: asking
+    for a job that is queued or running adds another requester to it.
+    """
+
+    def __init__(self, path=None, lease_seconds=None, max_attempts=None):
+        self.path = path or path_to_job_db
+        self.lease_seconds = lease_seconds or job_lease_seconds
+        self.max_attempts = max_attempts or job_max_attempts
+        self._lock = threading.Lock()
+        # Transactions are explicit: claiming a job must not race other processes
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(schema)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def enqueue(self, job_key, album_url, chat_id, size_policy=None):
+        """
+        Queue a job
+
+        Returns:
+            the number of jobs waiting ahead of it, None if it joined an
+            identical job that is already queued or running
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._db.execute(
+                'SELECT id FROM jobs WHERE job_key = ? AND status IN (?, ?)',
+                (job_key, QUEUED, RUNNING)).fetchone()
+            if row:
+                self._db.execute('INSERT INTO job_requesters (job_id, chat_id) VALUES (?, ?)',
+                                 (row['id'], chat_id))
+                return None
+            ahead = self._db.execute('SELECT COUNT(*) FROM jobs WHERE status = ?',
+                                     (QUEUED,)).fetchone()[0]
+            self._db.execute(
+                'INSERT INTO jobs (job_key, album_url, chat_id, size_policy, status, '
+                'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_key, album_url, chat_id, size_policy, QUEUED, now, now))
+        return ahead
+
+    def give_up_expired(self):
+        """
+        Fail the jobs whose lease ran out on their last allowed run
+
+        Returns:
+            (job row, chat ids that joined it) for every job given up, so the
+            chats can be told
+        """
+        now = time.time()
+        given_up = []
+        with self._transaction():
+            rows = self._db.execute(
+                'SELECT * FROM jobs WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                (RUNNING, now, self.max_attempts)).fetchall()
+            for row in rows:
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? '
+                    'WHERE id = ?', (FAILED, 'lease expired', now, row['id']))
+                requesters = self._db.execute(
+                    'SELECT chat_id FROM job_requesters WHERE job_id = ?', (row['id'],)).fetchall()
+                given_up.append((row, [r['chat_id'] for r in requesters]))
+        return given_up
+
+    def claim(self, worker):
+        """Lease the oldest runnable job to worker, returns its row or None"""
+        now = time.time()
+        with self._transaction():
+            # Jobs that used up their runs on dead workers wait for give_up_expired
+            row = self._db.execute(
+                'SELECT id FROM jobs WHERE status = ? '
+                'OR (status = ? AND lease_until < ? AND attempts < ?) '
+                'ORDER BY id LIMIT 1', (QUEUED, RUNNING, now, self.max_attempts)).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, '
+                'lease_until = ?, updated_at = ? WHERE id = ?',
+                (RUNNING, worker, now + self.lease_seconds, now, row['id']))
+            return self._db.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+
+    def renew(self, job_id, worker):
+        """Extend the lease, returns False if the job was taken over by another worker"""
+        now = time.time()
+        with self._transaction():
+            cursor = self._db.execute(
+                'UPDATE jobs SET lease_until = ?, updated_at = ? '
+                'WHERE id = ? AND worker = ? AND status = ?',
+                (now + self.lease_seconds, now, job_id, worker, RUNNING))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, worker, result):
+        """
+        Record the outcome of a run, None for a job that failed for good
+
+        Returns:
+            chat ids that joined the job and still have to get the result
+        """
+        with self._transaction():
+            self._db.execute(
+                'UPDATE jobs SET status = ?, result = ?, lease_until = NULL, updated_at = ? '
+                'WHERE id = ? AND worker = ?',
+                (DONE if result else FAILED, result, time.time(), job_id, worker))
+            rows = self._db.execute('SELECT chat_id FROM job_requesters WHERE job_id = ?',
+                                    (job_id,)).fetchall()
+        return [row['chat_id'] for row in rows]
+
+    def retry(self, job_id, worker, error):
+        """Put a job that raised back into the queue, returns False once it is given up"""
+        with self._transaction():
+            row = self._db.execute('SELECT attempts FROM jobs WHERE id = ? AND worker = ?',
+                                   (job_id, worker)).fetchone()
+            if row is None:
+                return False
+            status = QUEUED if row['attempts'] < self.max_attempts else FAILED
+            self._db.execute(
+                'UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? '
+                'WHERE id = ?', (status, error, time.time(), job_id))
+        return status == QUEUED
+
+    def count(self, status):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM jobs WHERE status = ?',
+                                    (status,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SharedJobQueue:
+    """
+    AlbumJobQueue interface for the bot front-end
+
+    Jobs are only written to the JobStore; job_worker.py processes run them
+    and report progress and results to the chat themselves.
+    """
+
+    def __init__(self, key, path=None):
+        self.key = key
+        self.path = path
+        self.store = None
+
+    def start(self):
+        self.store = JobStore(self.path)
+
+    async def stop(self):
+        if self.store:
+            self.store.close()
+            self.store = None
+
+    async def submit(self, job):
+        """Enqueue a job, returns jobs ahead of it or None if it joined one in flight"""
+        ahead = await asyncio.to_thread(
+            self.store.enqueue, '|'.join(map(str, self.key(job))), job.album_url,
+            job.chat_id, str(job.size_policy) if job.size_policy else None)
+        if ahead is None:
+            metrics.jobs_shared.inc()
+        else:
+            metrics.jobs_queued.set(ahead + 1)
+        return ahead
+
+    def pending(self):
+        return self.store.count(QUEUED) if self.store else 0
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from telegram import Bot
+
+import metrics
+from album_jobs import AlbumJob, bot_job_workers
+from job_queue import JobStore, job_poll_interval
+from photo_sizes import SizePolicy
+from telegram_bot import process_album_job, share_album_result
+
+# Load environment variables
+load_dotenv()
+
+
+async def keep_lease(store, job_id, worker):
+    """Renew the lease of a running job until cancelled"""
+    while True:
+        await asyncio.sleep(store.lease_seconds / 3)
+        if not await asyncio.to_thread(store.renew, job_id, worker):
+            print(f'⚠️ Lost the lease of job {job_id}, another worker may run it again')
+            return
+
+
+async def share_result(job, chat_ids, result):
+    """Send the result of a job to every chat in chat_ids"""
+    for chat_id in chat_ids:
+        try:
+            await share_album_result(job._replace(chat_id=chat_id), result)
+        except Exception as e:
+            print(f'❌ Error sharing album job {job.album_url}: {e}')
+
+
+async def give_up_expired(store, context):
+    """Tell the chats of jobs that died with their workers too often"""
+    for row, followers in await asyncio.to_thread(store.give_up_expired):
+        print(f'❌ Job {row["id"]} given up after {row["attempts"]} expired lease(s)')
+        job = AlbumJob(row['album_url'], row['chat_id'], context)
+        await share_result(job, [row['chat_id']] + followers, None)
+
+
+async def run_job(store, worker, row, context):
+    """Run one leased job and hand its result to every chat that asked for it"""
+    size_policy = SizePolicy.parse(row['size_policy']) if row['size_policy'] else None
+    job = AlbumJob(row['album_url'], row['chat_id'], context, size_policy)
+    lease = asyncio.create_task(keep_lease(store, row['id'], worker))
+    started = time.monotonic()
+    try:
+        result = await process_album_job(job)
+    except Exception as e:
+        print(f'❌ Error in album job {job.album_url}: {e}')
+        if await asyncio.to_thread(store.retry, row['id'], worker, str(e)):
+            print(f'🔁 Job {row["id"]} queued again')
+            try:
+                await context.bot.send_message(chat_id=job.chat_id,
+                                               text=f"🔁 Retrying {job.album_url}...")
+            except Exception as e:
+                print(f'❌ Error notifying chat {job.chat_id}: {e}')
+            return
+        result = None
+    finally:
+        lease.cancel()
+    metrics.job_seconds.observe(time.monotonic() - started,
+                                status='ok' if result else 'failed')
+    followers = await asyncio.to_thread(store.finish, row['id'], worker, result)
+    await share_result(job, followers, result)
+
+
+async def work(store, worker, context, running):
+    """One job slot: claim, run, repeat"""
+    while True:
+        await give_up_expired(store, context)
+        row = await asyncio.to_thread(store.claim, worker)
+        if row is None:
+            await asyncio.sleep(job_poll_interval)
+            continue
+        print(f'▶️ {worker} runs job {row["id"]}: {row["album_url"]} (attempt {row["attempts"]})')
+        running.add(worker)
+        metrics.jobs_running.set(len(running))
+        try:
+            await run_job(store, worker, row, context)
+        finally:
+            running.discard(worker)
+            metrics.jobs_running.set(len(running))
+
+
+async def run(token, slots):
+    store = JobStore()
+    running = set()
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    async with Bot(token) as bot:
+        # process_album_job only needs context.bot to write to the chat
+        context = SimpleNamespace(bot=bot)
+        await asyncio.gather(*(work(store, f'{name}:{slot}', context, running)
+                               for slot in range(slots)))
+
+
+def main():
+    """Start a worker process for jobs queued by the bot front-end"""
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+
+    if not token:
+        print('Error: TELEGRAM_BOT_TOKEN not found in environment variables')
+        sys.exit(1)
+
+    if metrics.metrics_port:
+        metrics.registry.serve(metrics.metrics_port)
+        print(f'📈 Metrics available on port {metrics.metrics_port} at /metrics')
+
+    print(f'🛠 Worker started with {bot_job_workers} job slot(s). Press Ctrl+C to stop.')
+    try:
+        asyncio.run(run(token, bot_job_workers))
+    except KeyboardInterrupt:
+        # Running jobs are picked up again once their lease expires
+        print('\n⚠️ Worker stopped by user (Ctrl+C)')
+
+
+if __name__ == '__main__':
+    main()
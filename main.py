@@ -1,20 +1,39 @@
 import vk_api
-import requests
 import os
 import re
-import datetime
 import sys
 import shutil
+import threading
+from collections import Counter
 from dotenv import load_dotenv
 
-from get_vk_session import get_vk_session
-from upload_to_yandex_disk import upload_albums_to_yandex_disk
+import metrics
+from clients import clients
+from download_engine import DownloadEngine, DownloadTask, download_workers
+from http_client import get_download_client
+from vk_photos import list_album_photos
+from album_metadata import prefetch_albums
+from photo_sizes import SizePolicy, default_size_policy
+from image_transform import ImageTransformer
+from remote_index import RemoteIndex
+from state_store import StateStore
+from upload_to_yandex_disk import (upload_albums_to_yandex_disk, get_yandex_disk_client,
+                                   stream_photo_to_yandex_disk, release_uploaded,
+                                   spooled_download, streaming_mode, archive_mode,
+                                   archive_extensions)
+from yandex_uploader import YandexUploader, UploadTask, UPLOADED, SKIPPED, DEDUPLICATED, FAILED
+from spool import spool
+from pipeline import Pipeline, Stage
+from get_all_albums import commit_snapshot
 
 # Load environment variables
 load_dotenv()
 
 path_to_downloaded_albums = 'vk_downloaded_albums'
-path_to_albums_list = 'album_list_2.txt'
+# Point it to albums_delta.txt to sync only albums that changed since the last discovery
+path_to_albums_list = os.getenv('ALBUMS_LIST_PATH', 'album_list_2.txt')
+# Albums listed on VK at the same time in the sync pipeline
+pipeline_list_workers = int(os.getenv('PIPELINE_LIST_WORKERS', '2'))
 
 
 def print_progress(value, end_value, bar_length=20):
@@ -53,27 +72,18 @@ def read_data():
         sys.exit(e.errno)
 
     queries = []
-    for url in lines:
+    for line in lines:
+        # An album can override the size policy after its URL: "<url> max width 1280"
+        url, _, policy = line.partition(' ')
         try:
-            queries.append(process_url(url))
+            query = process_url(url)
+            query['size_policy'] = SizePolicy.parse(policy) if policy else default_size_policy
+            queries.append(query)
         except ValueError as e:
             print(e)
     return queries
 
 
-def download_image(url, local_file_name):
-    response = requests.get(url, stream=True)
-    if not response.ok:
-        print('bad response:', response)
-        return
-    with open(local_file_name, 'wb') as file:
-        for chunk in response.iter_content(1024):
-            # if not chunk:
-            #     break
-            file.write(chunk)
-    return
-
-
 def fix_illegal_album_title(title):
     illegal_character = '\/|:?<>*"'
     for c in illegal_character:
@@ -94,72 +104,309 @@ def clear_downloaded_albums():
     return True
 
 
-def download_albums():
-    """Download all albums from VK"""
-    queries = read_data()
-    vk_session = get_vk_session()
-
+def get_vk_api():
+    """Return the shared VK session, exits if the token doesn't work"""
     # Token-based authentication doesn't need auth() call
     # Only try auth if using login/password
     try:
-        api = vk_session.get_api()
-        # Test the API connection
-        api.users.get(user_ids=1)
+        return clients.vk_api()
     except Exception as e:
         print('could not authenticate to vk.com')
         print(e)
         print('please, check your token or user data in the file')
         sys.exit(1)
+
+
+def photo_source(p, album_path, size_policy):
+    """Return (url of the chosen size, path of the photo inside album_path)"""
+    image_src, file_name = size_policy.choose(p)
+    # TODO починить имена фоток
+    return image_src, album_path + '/' + file_name
+
+
+def album_urls(queries, failed_albums=()):
+    """URLs of the queried albums, as written by get_all_albums.py"""
+    urls = ('https://vk.com/album{}_{}'.format(q['owner_id'], q['album_id']) for q in queries)
+    return [url for url in urls if url not in failed_albums]
+
+
+def download_albums(stream_to=None, failed_albums=None, archive_to=None):
+    """
+    Download all albums from VK
+
+    Args:
+        stream_to: Yandex Disk path; when set, photos are piped straight into
+            Yandex Disk and nothing is written to local disk
+        failed_albums: optional list that receives the URLs of albums that
+            could not be listed or have failed photos
+        archive_to: Yandex Disk path the albums are archived to (ARCHIVE_MODE);
+            an archive is rebuilt whole, so a changed album is fetched in full
+
+    Returns:
+        False if the albums could not be resolved or any photo failed, else True
+    """
+    queries = read_data()
+    api = get_vk_api()
     l = None
     p = None
+    # Photos finished by an earlier (possibly interrupted) run are not fetched again
+    state = StateStore()
+    # Optional re-encoding between download and upload (RECOMPRESS_FORMAT)
+    transformer = ImageTransformer()
+    if stream_to and transformer.enabled:
+        print('recompression is skipped in streaming mode, photos are uploaded as fetched')
+    if stream_to:
+        y = get_yandex_disk_client()
+        remote_index = RemoteIndex(y)
+        remote_index.ensure_dir(stream_to)
+        engine = DownloadEngine(
+            lambda url, remote_path: stream_photo_to_yandex_disk(y, url, remote_path, state))
+    else:
+        engine = DownloadEngine(get_download_client().download)
+
+    # Resolve titles and sizes of all albums before any download starts
+    try:
+        albums = prefetch_albums(api, queries)
+    except vk_api.exceptions.ApiError as e:
+        print('exception:')
+        print(e)
+        return False
 
     print('number of albums to download: {}'.format(queries.__len__()))
+    failed_albums = [] if failed_albums is None else failed_albums
+    photos_failed = 0
     for q in queries:
         o = q['owner_id']
         a = q['album_id']
 
+        album = albums.get((o, a))
+        if album is None:
+            print('album not found: https://vk.com/album{}_{}'.format(o, a))
+            continue
+
         try:
-            album = api.photos.getAlbums(owner_id=o, album_ids=a)['items'][0]
             title = album['title']
             title = fix_illegal_album_title(title)
-            images_num = album['size']
-            photos = api.photos.get(owner_id=o, album_id=a, photo_sizes=1, count=images_num)['items']
+            photos = list_album_photos(api, o, a)
         except vk_api.exceptions.ApiError as e:
+            # Throttling is already retried by the session, skip just this album;
+            # the state store picks it up again on the next run
             print('exception:')
             print(e)
-            return False
+            failed_albums.append('https://vk.com/album{}_{}'.format(o, a))
+            continue
 
-        album_path = path_to_downloaded_albums + '/' + title
-        if not os.path.exists(album_path):
-            os.makedirs(album_path)
+        if stream_to:
+            album_path = stream_to + '/' + title
+            remote_index.ensure_dir(album_path)
         else:
-            album_path += '.copy_{:%Y-%m-%d_%H-%M-%S}'.format(
-                datetime.datetime.now())
-            os.makedirs(album_path)
+            # Reuse the folder of an earlier run, finished photos are skipped below
+            album_path = path_to_downloaded_albums + '/' + title
+            os.makedirs(album_path, exist_ok=True)
 
         print('downloading album: ' + title)
-        cnt = 0
-        for p in photos:
-            largest_image_width = p['sizes'][0]['width']
-            largest_image_src = p['sizes'][0]['url']
-
-            if largest_image_width == 0:
-                largest_image_src = p['sizes'][p['sizes'].__len__() - 1]['url']
-            else:
-                for size in p['sizes']:
-                    if size['width'] > largest_image_width:
-                        largest_image_width = size['width']
-                        largest_image_src = size['url']
-
-            extension = os.path.splitext(largest_image_src)[-1].split('?')[0]
-            # TODO починить имена фоток
-            download_image(largest_image_src, album_path + '/' +
-                           str(p['id']) + extension)
-            cnt += 1
-            print_progress(cnt, images_num)
+        known_photos = state.album_photos(o, a)
+        sources = [photo_source(p, album_path, q['size_policy']) for p in photos]
+        if archive_to:
+            remote_archive_path = archive_to + '/' + title + archive_extensions[archive_mode]
+            if all(state.is_uploaded(known_photos.get(str(p['id'])), remote_archive_path,
+                                     photo_path)
+                   for p, (_, photo_path) in zip(photos, sources)):
+                print('archive is up to date, skipping album: ' + title)
+                continue
+        tasks = []
+        photo_ids = []
+        for p, (image_src, photo_path) in zip(photos, sources):
+            row = known_photos.get(str(p['id']))
+            if stream_to and state.is_uploaded(row, photo_path):
+                continue
+            # Photos already inside the archive are needed again to rebuild it
+            if not stream_to and (
+                    (state.is_uploaded(row, photo_path=photo_path) and not archive_to) or
+                    state.is_downloaded(row, photo_path)):
+                continue
+            tasks.append(DownloadTask(image_src, photo_path))
+            photo_ids.append(p['id'])
+
+        if len(tasks) < len(photos):
+            print('skipping {} photo(s) finished by an earlier run'.format(
+                len(photos) - len(tasks)))
+        results = engine.download(tasks, print_progress)
+        if transformer.enabled and not stream_to:
+            print()
+            print('recompressing {} photo(s)'.format(sum(1 for r in results if r)))
+            tasks, results = transformer.transform_downloads(tasks, results, print_progress)
+        for task, photo_id, result in zip(tasks, photo_ids, results):
+            if stream_to and result:
+                state.mark_uploaded(o, a, photo_id, task.path)
+            elif result:
+                state.mark_downloaded(o, a, photo_id, task.path, result.size, result.md5,
+                                      result.sha256)
+            elif not stream_to:
+                state.mark_download_failed(o, a, photo_id, task.path)
         print()
+        album_failed = sum(1 for r in results if not r)
+        if album_failed:
+            # Kept out of the snapshot, so the next run tries the album again
+            print('✗ {} photo(s) failed'.format(album_failed))
+            failed_albums.append('https://vk.com/album{}_{}'.format(o, a))
+            photos_failed += album_failed
     
-    return True
+    if transformer.original_bytes:
+        print(transformer.report())
+    
+    if failed_albums:
+        print('could not sync {} album(s) completely:'.format(len(failed_albums)))
+        for url in failed_albums:
+            print(url)
+    
+    return not photos_failed
+
+
+def sync_albums(upload_to, failed_albums=None):
+    """
+    Download all albums from VK and upload them to Yandex Disk as one pipeline
+
+    list (VK API) → download (CDN) → upload (Yandex Disk) run at the same time
+    across albums, connected by bounded queues: album N+1 is listed and fetched
+    while album N uploads. Photos are deleted once their upload is confirmed
+    and downloads pause while the spool budget (SPOOL_BUDGET_MB) is full.
+
+    Args:
+        upload_to: Yandex Disk path the album folders are created in
+        failed_albums: optional list that receives the URLs of albums that
+            could not be listed
+
+    Returns:
+        False if any photo failed to download or upload (partial and unsent
+        files stay on local disk), else True
+    """
+    queries = read_data()
+    api = get_vk_api()
+    # Photos finished by an earlier (possibly interrupted) run are not fetched again
+    state = StateStore()
+    # Optional re-encoding between download and upload (RECOMPRESS_FORMAT)
+    transformer = ImageTransformer()
+    uploader = YandexUploader(get_yandex_disk_client(), content_index=state)
+    uploader.index.ensure_dir(upload_to)
+
+    # Resolve titles and sizes of all albums before any download starts
+    try:
+        albums = prefetch_albums(api, queries)
+    except vk_api.exceptions.ApiError as e:
+        print('exception:')
+        print(e)
+        return False
+
+    def remote_path_for(local_path):
+        return upload_to + '/' + os.path.relpath(local_path, path_to_downloaded_albums)
+
+    # (owner_id, album_id, photo_id) of every photo in flight, by its task path
+    photo_keys = {}
+
+    def on_downloaded(path, local_path, result):
+        state.mark_downloaded(*photo_keys[path], local_path, result.size, result.md5,
+                              result.sha256)
+
+    stats = Counter()
+    stats_lock = threading.Lock()
+    on_uploaded = release_uploaded(state)
+    failed_albums = [] if failed_albums is None else failed_albums
+
+    def list_album(q):
+        """Stage 1: list photos of an album and queue the ones still to do"""
+        o = q['owner_id']
+        a = q['album_id']
+        album = albums.get((o, a))
+        if album is None:
+            print('album not found: https://vk.com/album{}_{}'.format(o, a))
+            return None
+        try:
+            photos = list_album_photos(api, o, a)
+        except vk_api.exceptions.ApiError as e:
+            # Throttling is already retried by the session, skip just this album;
+            # the state store picks it up again on the next run
+            print('exception:')
+            print(e)
+            failed_albums.append('https://vk.com/album{}_{}'.format(o, a))
+            return None
+
+        title = fix_illegal_album_title(album['title'])
+        # Reuse the folder of an earlier run, finished photos are skipped below
+        album_path = path_to_downloaded_albums + '/' + title
+        os.makedirs(album_path, exist_ok=True)
+        uploader.index.ensure_dir(remote_path_for(album_path))
+
+        known_photos = state.album_photos(o, a)
+        tasks = []
+        for p in photos:
+            image_src, photo_path = photo_source(p, album_path, q['size_policy'])
+            row = known_photos.get(str(p['id']))
+            if state.is_uploaded(row, photo_path=photo_path):
+                continue
+            if state.is_downloaded(row, photo_path):
+                # Left on disk by an interrupted run, only the upload is missing
+                spool.add(row['local_path'], row['size'])
+                pipeline['upload'].submit(UploadTask(
+                    row['local_path'], remote_path_for(row['local_path']),
+                    row['checksum'], row['sha256']))
+                continue
+            photo_keys[photo_path] = (o, a, p['id'])
+            tasks.append(DownloadTask(image_src, photo_path))
+        print('album: {} ({} of {} photo(s) to download)'.format(title, len(tasks), len(photos)))
+        return tasks
+
+    def download_photo(task):
+        """Stage 2: fetch one photo, the spooled download hands it to the upload stage"""
+        try:
+            if not engine.run(task):
+                raise RuntimeError('could not download ' + task.path)
+        except Exception:
+            state.mark_download_failed(*photo_keys[task.path], task.path)
+            # Re-raised so the download stage counts it as failed
+            raise
+        finally:
+            del photo_keys[task.path]
+
+    def upload_photo(task):
+        """Stage 3: upload one photo and delete it once Yandex Disk has it"""
+        status = uploader.upload_one(task)
+        on_uploaded(task, status)
+        with stats_lock:
+            stats[status] += 1
+
+    pipeline = Pipeline([
+        Stage('list', list_album, pipeline_list_workers),
+        Stage('download', download_photo, download_workers),
+        Stage('upload', upload_photo, uploader.workers),
+    ])
+    engine = DownloadEngine(spooled_download(
+        get_download_client().download, pipeline['upload'], remote_path_for,
+        on_downloaded, transformer))
+
+    print('number of albums to sync: {}'.format(len(queries)))
+    pipeline.run(queries)
+
+    print()
+    print('Pipeline summary ({:.1f}s):'.format(pipeline.elapsed))
+    for line in pipeline.summary():
+        print('  ' + line)
+    print('✓ Uploaded {} new photo(s), skipped {} existing, copied {} duplicate(s)'.format(
+        stats[UPLOADED], stats[SKIPPED], stats[DEDUPLICATED]))
+    if transformer.original_bytes:
+        print(transformer.report())
+    if failed_albums:
+        print('could not list {} album(s):'.format(len(failed_albums)))
+        for url in failed_albums:
+            print(url)
+    download_failed = pipeline['download'].failed
+    if download_failed:
+        print('✗ Failed to download {} photo(s), partial files stay in {} for the next run'.format(
+            download_failed, path_to_downloaded_albums))
+    if stats[FAILED]:
+        print('✗ Failed to upload {} photo(s), they stay in {} for the next run'.format(
+            stats[FAILED], path_to_downloaded_albums))
+    return not (download_failed or stats[FAILED])
 
 
 def main():
@@ -169,10 +416,53 @@ def main():
     print('=' * 60)
     print()
     
+    yandex_disk_path = os.getenv('YANDEX_DISK_PATH', '/VK_Albums')
+    # Albums that could not be listed stay in the next albums_delta.txt
+    failed_albums = []
+    
+    if streaming_mode:
+        # Single step: VK responses are piped straight into Yandex Disk
+        print('STEP 1: Streaming albums from VK to Yandex Disk...')
+        print('-' * 60)
+        if not download_albums(stream_to=yandex_disk_path, failed_albums=failed_albums):
+            print('\n✗ Streaming failed. Stopping workflow.')
+            sys.exit(1)
+        
+        commit_snapshot(album_urls(read_data(), failed_albums))
+        print()
+        print('=' * 60)
+        print('✓ WORKFLOW COMPLETED SUCCESSFULLY!')
+        print('=' * 60)
+        return
+    
+    if not archive_mode:
+        # Photos are uploaded while downloads go on and deleted once confirmed,
+        # so local disk holds at most SPOOL_BUDGET_MB at a time
+        print('STEP 1: Syncing albums from VK to Yandex Disk...')
+        print('-' * 60)
+        if not sync_albums(yandex_disk_path, failed_albums):
+            print('\n✗ Sync failed. Stopping workflow.')
+            print('Local files will NOT be deleted due to download / upload failures.')
+            sys.exit(1)
+        
+        print()
+        print('STEP 2: Cleaning up local files...')
+        print('-' * 60)
+        clear_downloaded_albums()
+        
+        commit_snapshot(album_urls(read_data(), failed_albums))
+        print()
+        print('=' * 60)
+        print('✓ WORKFLOW COMPLETED SUCCESSFULLY!')
+        print('=' * 60)
+        return
+    
+    # Archives are built from whole albums, so they are downloaded first
     # Step 1: Download albums from VK
     print('STEP 1: Downloading albums from VK...')
     print('-' * 60)
-    download_success = download_albums()
+    download_success = download_albums(failed_albums=failed_albums,
+                                       archive_to=yandex_disk_path)
     
     if not download_success:
         print('\n✗ Download failed. Stopping workflow.')
@@ -185,13 +475,15 @@ def main():
     print('STEP 2: Uploading albums to Yandex Disk...')
     print('-' * 60)
     try:
-        yandex_disk_path = os.getenv('YANDEX_DISK_PATH', '/VK_Albums')
-        upload_albums_to_yandex_disk(yandex_disk_path)
-        print('\n✓ All albums uploaded to Yandex Disk successfully!')
+        upload_success = upload_albums_to_yandex_disk(yandex_disk_path)
     except Exception as e:
         print(f'\n✗ Upload to Yandex Disk failed: {e}')
+        upload_success = False
+    if not upload_success:
+        print('\n✗ Upload to Yandex Disk failed. Stopping workflow.')
         print('Local files will NOT be deleted due to upload failure.')
         sys.exit(1)
+    print('\n✓ All albums uploaded to Yandex Disk successfully!')
     
     # Step 3: Cleanup local files
     print()
@@ -199,6 +491,7 @@ def main():
     print('-' * 60)
     clear_downloaded_albums()
     
+    commit_snapshot(album_urls(read_data(), failed_albums))
     print()
     print('=' * 60)
     print('✓ WORKFLOW COMPLETED SUCCESSFULLY!')
@@ -206,4 +499,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # Shows which stage (VK, CDN, Yandex) the time went to, also for failed runs
+        print()
+        metrics.print_summary()
\ No newline at end of file
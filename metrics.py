@@ -0,0 +1,217 @@
+import os
+import time
+import bisect
+import threading
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Port of the bot's Prometheus endpoint, 0 disables it
+metrics_port = int(os.getenv('METRICS_PORT', '0'))
+
+# Upper bounds in seconds shared by all latency histograms
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in pairs) + '}'
+
+
+class Metric:
+    """Named, labelled, thread-safe value; subclasses define how values change"""
+
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, _format_labels(key), value))
+        return lines
+
+    def summary(self):
+        with self._lock:
+            return ['{}{} {:g}'.format(self.name, _format_labels(key), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=latency_buckets):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += value
+            series['max'] = max(series['max'], value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with-block, also when it raises"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name, _format_labels(key, [('le', bound)]), cumulative))
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(key, [('le', '+Inf')]), series['count']))
+                lines.append('{}_sum{} {}'.format(self.name, _format_labels(key), series['sum']))
+                lines.append('{}_count{} {}'.format(self.name, _format_labels(key), series['count']))
+        return lines
+
+    def summary(self):
+        with self._lock:
+            return ['{}{} count={} avg={:.3f}s max={:.3f}s'.format(
+                        self.name, _format_labels(key), s['count'],
+                        s['sum'] / s['count'], s['max'])
+                    for key, s in sorted(self._values.items())]
+
+
+class MetricsRegistry:
+    """All metrics of the process, rendered for Prometheus or as a plain summary"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description):
+        return self._add(Counter(name, description))
+
+    def gauge(self, name, description):
+        return self._add(Gauge(name, description))
+
+    def histogram(self, name, description, buckets=latency_buckets):
+        return self._add(Histogram(name, description, buckets))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Human readable lines for every metric that has been touched"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.summary())
+        return lines
+
+    def serve(self, port, host='0.0.0.0'):
+        """Expose /metrics on a daemon thread, returns the server"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+registry = MetricsRegistry()
+
+vk_request_seconds = registry.histogram(
+    'vk_api_request_seconds', 'Latency of VK API calls by method')
+vk_errors = registry.counter(
+    'vk_api_errors_total', 'VK API errors by error code')
+cdn_download_seconds = registry.histogram(
+    'cdn_download_seconds', 'Time to fetch one photo from the VK CDN')
+yandex_upload_seconds = registry.histogram(
+    'yandex_upload_seconds', 'Time to upload one photo to Yandex Disk')
+transfers = registry.counter(
+    'transfers_total', 'Finished photo transfers by stage and outcome')
+transferred_bytes = registry.counter(
+    'transferred_bytes_total', 'Bytes received from the CDN / sent to Yandex Disk')
+retries = registry.counter(
+    'retries_total', 'Retried requests by stage')
+jobs_queued = registry.gauge(
+    'album_jobs_queued', 'Bot album jobs waiting for a worker')
+jobs_running = registry.gauge(
+    'album_jobs_running', 'Bot album jobs being processed')
+spool_bytes = registry.gauge(
+    'spool_bytes', 'Downloaded photos on local disk waiting for upload')
+pipeline_queue_depth = registry.gauge(
+    'pipeline_queue_depth', 'Items waiting in front of a CLI pipeline stage')
+jobs_shared = registry.counter(
+    'album_jobs_shared_total', 'Bot album jobs answered by an identical job already in flight')
+result_cache = registry.counter(
+    'album_result_cache_total', 'Bot album jobs answered from the export cache (hit) or synced (miss)')
+job_seconds = registry.histogram(
+    'album_job_seconds', 'Duration of a bot album job')
+
+
+def print_summary():
+    """Print every recorded metric, used at the end of a CLI run"""
+    print('Metrics:')
+    for line in registry.summary():
+        print('  ' + line)
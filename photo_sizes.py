@@ -0,0 +1,100 @@
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Default policy: "max", "max width N" or VK size types in order of preference ("w,z,y")
+photo_size_policy = os.getenv('PHOTO_SIZE_POLICY', 'max')
+
+# Largest width of every VK size type, used when VK reports width 0
+# (old photos) so the choice still follows the real size instead of list order
+type_widths = {
+    's': 75, 'm': 130, 'o': 130, 'p': 200, 'q': 320, 'r': 510,
+    'x': 604, 'y': 807, 'z': 1080, 'w': 2560,
+}
+
+max_width_pattern = re.compile(r'^max\s+width\s+(\d+)$')
+types_pattern = re.compile(r'^[a-z](\s*,\s*[a-z])*$')
+
+
+def effective_width(size):
+    return size.get('width') or type_widths.get(size.get('type'), 0)
+
+
+class SizePolicy:
+    """
+    Picks which of the VK sizes of a photo to download
+
+    "max" takes the widest size, "max width N" the widest one not wider than
+    N pixels (or the narrowest if all are wider), a list of size types takes
+    the first type the photo has (or the widest if it has none of them).
+    """
+
+    def __init__(self, max_width=None, types=None):
+        self.max_width = max_width
+        self.types = types
+        if types:
+            self._preference = {t: len(types) - i for i, t in enumerate(types)}
+
+    @classmethod
+    def parse(cls, text):
+        """Build a policy from its text form, raises ValueError if it isn't one"""
+        text = ' '.join(text.lower().split())
+        if text in ('', 'max'):
+            return cls()
+        match = max_width_pattern.match(text)
+        if match:
+            return cls(max_width=int(match.group(1)))
+        if types_pattern.match(text):
+            return cls(types=[t.strip() for t in text.split(',')])
+        raise ValueError('invalid photo size policy: {} '
+                         '(use "max", "max width N" or size types like "w,z,y")'.format(text))
+
+    def _key(self, size):
+        width = effective_width(size)
+        if self.max_width:
+            fits = width <= self.max_width
+            return fits, width if fits else -width
+        if self.types:
+            return self._preference.get(size.get('type'), 0), width
+        return width, 0
+
+    def select(self, sizes):
+        """Return the chosen entry of a photo's `sizes` list in a single pass"""
+        best = None
+        best_key = None
+        for size in sizes:
+            key = self._key(size)
+            if best_key is None or key > best_key:
+                best = size
+                best_key = key
+        return best
+
+    def choose(self, photo):
+        """
+        Return (url, file name) of the chosen size of a VK photo
+
+        The widest size is saved as "<id>.<ext>", any other size adds its type
+        ("<id>_x.jpg"), so copies at different sizes never share a path, a
+        .part file to resume or a state record.
+        """
+        sizes = photo['sizes']
+        size = self.select(sizes)
+        url = size['url']
+        extension = os.path.splitext(url)[-1].split('?')[0]
+        name = str(photo['id'])
+        if effective_width(size) < max(effective_width(s) for s in sizes):
+            name += '_' + (size.get('type') or str(effective_width(size)))
+        return url, name + extension
+
+    def __str__(self):
+        if self.max_width:
+            return 'max width {}'.format(self.max_width)
+        if self.types:
+            return ','.join(self.types)
+        return 'max'
+
+
+default_size_policy = SizePolicy.parse(photo_size_policy)
@@ -0,0 +1,115 @@
+import os
+import time
+import queue
+import threading
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Items waiting in front of a stage; a full queue pauses the stage feeding it
+pipeline_queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '64'))
+
+# Tells a worker that its stage has no more input
+_done = object()
+
+
+class Stage:
+    """One step of a Pipeline: a function run by its own worker threads"""
+
+    def __init__(self, name, func, workers, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input = queue.Queue(maxsize=queue_size or pipeline_queue_size)
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue an item for this stage, blocks while the stage is backed up"""
+        self.input.put(item)
+        metrics.pipeline_queue_depth.set(self.input.qsize(), stage=self.name)
+
+    def _record(self, busy, blocked, failed):
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.busy += busy
+            self.blocked += blocked
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, all running at the same time
+
+    A stage function takes one item and returns an iterable of items for the
+    next stage (or None). It may also submit items to any later stage itself.
+    Because every queue is bounded, a slow stage holds back the ones before it
+    instead of letting work pile up in memory.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.elapsed = 0.0
+
+    def __getitem__(self, name):
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.input.get()
+            if item is _done:
+                return
+            metrics.pipeline_queue_depth.set(stage.input.qsize(), stage=stage.name)
+            started = time.monotonic()
+            failed = False
+            try:
+                outputs = stage.func(item)
+            except Exception as e:
+                print(f'\nError in {stage.name} stage: {e}')
+                outputs = None
+                failed = True
+            finished = time.monotonic()
+            for output in outputs or ():
+                next_stage.submit(output)
+            stage._record(finished - started, time.monotonic() - finished, failed)
+
+    def run(self, items):
+        """Feed items into the first stage and return once every stage is drained"""
+        started = time.monotonic()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            threads.append([threading.Thread(target=self._work, args=(index,), daemon=True)
+                            for _ in range(stage.workers)])
+            for thread in threads[-1]:
+                thread.start()
+
+        for item in items:
+            self.stages[0].submit(item)
+
+        # Stop stages in order: a stage only finishes once all its input has arrived
+        for stage, stage_threads in zip(self.stages, threads):
+            for _ in stage_threads:
+                stage.input.put(_done)
+            for thread in stage_threads:
+                thread.join()
+        self.elapsed = time.monotonic() - started
+
+    def summary(self):
+        """One line per stage: items, failures and how busy its workers were"""
+        lines = []
+        for stage in self.stages:
+            capacity = self.elapsed * stage.workers
+            lines.append('{:<10} {:>3} worker(s) {:>7} item(s) {:>5} failed  '
+                         'busy {:>3.0f}%  waiting on next stage {:>3.0f}%'.format(
+                             stage.name, stage.workers, stage.processed, stage.failed,
+                             stage.busy * 100 / capacity if capacity else 0,
+                             stage.blocked * 100 / capacity if capacity else 0))
+        return lines
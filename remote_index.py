@@ -0,0 +1,96 @@
+import os
+import posixpath
+import threading
+import yadisk
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Items requested per listdir page
+listdir_page_size = int(os.getenv('YANDEX_LISTDIR_PAGE_SIZE', '1000'))
+
+# Only the item fields the skip decision needs; yadisk prefixes them with
+# _embedded.items and adds the fields its own paging relies on
+listdir_fields = ['name', 'type', 'size', 'md5']
+
+
+class RemoteIndex:
+    """
+    In-memory view of Yandex Disk folders used instead of per-file API calls
+
+    Each folder is listed once (paged, with only the needed fields) into a
+    name -> (size, md5) index, and directories known to exist are remembered
+    so exists/mkdir checks are not repeated. Network calls run under a lock
+    per path, so lookups in cached folders never wait for another folder.
+    """
+
+    def __init__(self, y, page_size=None):
+        self.y = y
+        self.page_size = page_size or listdir_page_size
+        self._dirs = set()
+        self._folders = {}
+        # Guards the dicts above, never held during a network call
+        self._lock = threading.Lock()
+        self._path_locks = {}
+
+    def _path_lock(self, path):
+        with self._lock:
+            return self._path_locks.setdefault(path, threading.Lock())
+
+    def ensure_dir(self, path):
+        """Create directory on Yandex Disk unless it is already known to exist"""
+        with self._lock:
+            if path in self._dirs:
+                return
+        with self._path_lock(path):
+            with self._lock:
+                if path in self._dirs:
+                    return
+            created = False
+            try:
+                self.y.mkdir(path)
+                created = True
+            except yadisk.exceptions.PathExistsError:
+                pass
+            with self._lock:
+                if created:
+                    # A new directory is empty, no need to list it later
+                    self._folders.setdefault(path, {})
+                self._dirs.add(path)
+
+    def listing(self, folder):
+        """Return name -> (size, md5) for all files in folder, fetched once"""
+        with self._lock:
+            if folder in self._folders:
+                return self._folders[folder]
+        with self._path_lock(folder):
+            with self._lock:
+                if folder in self._folders:
+                    return self._folders[folder]
+            files = {}
+            found = False
+            try:
+                for item in self.y.listdir(folder, limit=self.page_size,
+                                           fields=listdir_fields):
+                    if item.type == 'file':
+                        files[item.name] = (item.size, item.md5)
+                found = True
+            except yadisk.exceptions.PathNotFoundError:
+                pass
+            with self._lock:
+                if found:
+                    self._dirs.add(folder)
+                return self._folders.setdefault(folder, files)
+
+    def lookup(self, remote_path):
+        """Return (size, md5) of a remote file or None if it isn't on the disk"""
+        folder, name = posixpath.split(remote_path)
+        return self.listing(folder).get(name)
+
+    def add(self, remote_path, size, md5=None):
+        """Record a file that has just been uploaded"""
+        folder, name = posixpath.split(remote_path)
+        self.listing(folder)
+        with self._lock:
+            self._folders[folder][name] = (size, md5)
@@ -0,0 +1,57 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Downloaded photos allowed on local disk while they wait for upload, 0 for no limit
+spool_budget = int(float(os.getenv('SPOOL_BUDGET_MB', '2048')) * 1024 * 1024)
+
+
+class Spool:
+    """
+    Byte budget for photos between download and upload
+
+    Downloaders wait for room before fetching a photo and add it once it is on
+    disk; the photo is deleted and its bytes freed as soon as its upload is
+    confirmed. A download that is already running is not interrupted, so the
+    budget can be exceeded by at most one photo per download worker.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = spool_budget if budget is None else budget
+        self.used = 0
+        self._files = {}
+        self._cond = threading.Condition()
+
+    def wait_for_room(self):
+        """Block while the budget is used up"""
+        with self._cond:
+            while self.budget and self.used >= self.budget:
+                self._cond.wait()
+
+    def add(self, path, size):
+        """Account for a photo that is now on local disk"""
+        with self._cond:
+            self.used += size - self._files.get(path, 0)
+            self._files[path] = size
+            metrics.spool_bytes.set(self.used)
+
+    def release(self, path, delete=True):
+        """Free a photo's bytes, deleting the file unless it has to stay for a retry"""
+        if delete:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._cond:
+            self.used -= self._files.pop(path, 0)
+            metrics.spool_bytes.set(self.used)
+            self._cond.notify_all()
+
+
+# One budget for the whole process, shared by every album and bot job
+spool = Spool()
@@ -0,0 +1,229 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Local database with the sync state of every photo
+path_to_state_db = os.getenv('STATE_DB_PATH', 'album_state.sqlite3')
+
+DONE = 'done'
+FAILED = 'failed'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS photos (
+    owner_id TEXT NOT NULL,
+    album_id TEXT NOT NULL,
+    photo_id TEXT NOT NULL,
+    local_path TEXT,
+    remote_path TEXT,
+    size INTEGER,
+    checksum TEXT,
+    download_status TEXT,
+    upload_status TEXT,
+    updated_at REAL,
+    PRIMARY KEY (owner_id, album_id, photo_id)
+);
+CREATE INDEX IF NOT EXISTS photos_local_path ON photos (local_path);
+CREATE TABLE IF NOT EXISTS albums (
+    owner_id TEXT NOT NULL,
+    album_id TEXT NOT NULL,
+    title TEXT,
+    vk_updated INTEGER,
+    size INTEGER,
+    size_policy TEXT,
+    archive_mode TEXT,
+    remote_path TEXT,
+    public_url TEXT,
+    updated_at REAL,
+    PRIMARY KEY (owner_id, album_id)
+);
+CREATE TABLE IF NOT EXISTS contents (
+    sha256 TEXT PRIMARY KEY,
+    md5 TEXT,
+    size INTEGER,
+    remote_path TEXT NOT NULL
+);
+'''
+
+
+class StateStore:
+    """
+    Persistent download / upload state of photos keyed by (owner_id, album_id, photo_id)
+
+    Lets reruns process only photos that are missing or failed.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or path_to_state_db
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript(schema)
+            # Databases created before content hashing lack the sha256 column
+            columns = {row['name'] for row in self._db.execute('PRAGMA table_info(photos)')}
+            if 'sha256' not in columns:
+                self._db.execute('ALTER TABLE photos ADD COLUMN sha256 TEXT')
+
+    def album_photos(self, owner_id, album_id):
+        """Return photo_id -> row for every known photo of an album"""
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT * FROM photos WHERE owner_id = ? AND album_id = ?',
+                (str(owner_id), str(album_id))).fetchall()
+        return {row['photo_id']: row for row in rows}
+
+    def is_same_size(self, row, photo_path):
+        """
+        Check if a photo row was recorded for the file name of photo_path
+
+        The file name carries the chosen VK size (see SizePolicy.choose), a row
+        of the same photo at another size does not count; recompression may
+        change the extension.
+        """
+        path = row['local_path'] or row['remote_path']
+        return path is not None and (os.path.splitext(os.path.basename(path))[0]
+                                     == os.path.splitext(os.path.basename(photo_path))[0])
+
+    def is_downloaded(self, row, photo_path=None):
+        """Check if a photo row has a complete local copy (of photo_path, when given)"""
+        return (row is not None and row['download_status'] == DONE
+                and row['local_path'] is not None
+                and (photo_path is None or self.is_same_size(row, photo_path))
+                and os.path.exists(row['local_path'])
+                and os.path.getsize(row['local_path']) == row['size'])
+
+    def is_uploaded(self, row, remote_path=None, photo_path=None):
+        """Check if a photo row was uploaded (to remote_path / as photo_path, when given)"""
+        return (row is not None and row['upload_status'] == DONE
+                and (remote_path is None or row['remote_path'] == remote_path)
+                and (photo_path is None or self.is_same_size(row, photo_path)))
+
+    def _upsert(self, owner_id, album_id, photo_id, **fields):
+        self._upsert_many(owner_id, album_id, [(photo_id, fields)])
+
+    def _upsert_many(self, owner_id, album_id, photos):
+        """Write (photo_id, fields) pairs of one album in a single transaction"""
+        now = time.time()
+        # One statement per set of columns
+        groups = defaultdict(list)
+        for photo_id, fields in photos:
+            groups[tuple(fields)].append(
+                (str(owner_id), str(album_id), str(photo_id), *fields.values(), now))
+        with self._lock, self._db:
+            for names, rows in groups.items():
+                names = names + ('updated_at',)
+                columns = ', '.join(names)
+                placeholders = ', '.join('?' * len(names))
+                updates = ', '.join(f'{c} = excluded.{c}' for c in names)
+                self._db.executemany(
+                    f'INSERT INTO photos (owner_id, album_id, photo_id, {columns}) '
+                    f'VALUES (?, ?, ?, {placeholders}) '
+                    f'ON CONFLICT (owner_id, album_id, photo_id) DO UPDATE SET {updates}',
+                    rows)
+
+    def mark_downloaded(self, owner_id, album_id, photo_id, local_path, size, checksum,
+                        sha256=None):
+        self._upsert(owner_id, album_id, photo_id, local_path=local_path, size=size,
+                     checksum=checksum, sha256=sha256, download_status=DONE)
+
+    def mark_download_failed(self, owner_id, album_id, photo_id, local_path):
+        self._upsert(owner_id, album_id, photo_id, local_path=local_path,
+                     download_status=FAILED)
+
+    def mark_uploaded(self, owner_id, album_id, photo_id, remote_path):
+        self._upsert(owner_id, album_id, photo_id, remote_path=remote_path,
+                     upload_status=DONE)
+
+    def mark_many(self, owner_id, album_id, downloaded=(), download_failed=(), uploaded=()):
+        """
+        Record the results of a whole album in one transaction
+
+        Args:
+            downloaded: (photo_id, local_path, size, checksum, sha256) tuples
+            download_failed: (photo_id, local_path) tuples
+            uploaded: (photo_id, remote_path) tuples
+        """
+        photos = [(photo_id, {'local_path': local_path, 'size': size, 'checksum': checksum,
+                              'sha256': sha256, 'download_status': DONE})
+                  for photo_id, local_path, size, checksum, sha256 in downloaded]
+        photos += [(photo_id, {'local_path': local_path, 'download_status': FAILED})
+                   for photo_id, local_path in download_failed]
+        photos += [(photo_id, {'remote_path': remote_path, 'upload_status': DONE})
+                   for photo_id, remote_path in uploaded]
+        if photos:
+            self._upsert_many(owner_id, album_id, photos)
+
+    def mark_uploaded_by_path(self, local_path, remote_path, status=DONE):
+        """Record upload result of a downloaded file identified by its local path"""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE photos SET remote_path = ?, upload_status = ?, updated_at = ? '
+                'WHERE local_path = ?',
+                (remote_path, status, time.time(), local_path))
+
+    def uploaded_files(self, local_dir):
+        """Return local_path -> remote_path of already uploaded files from a local folder"""
+        prefix = os.path.join(local_dir, '')
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT local_path, remote_path FROM photos '
+                'WHERE upload_status = ? AND substr(local_path, 1, ?) = ?',
+                (DONE, len(prefix), prefix)).fetchall()
+        return {row['local_path']: row['remote_path'] for row in rows}
+
+    def file_hashes(self, local_dir):
+        """Return local_path -> (md5, sha256) of downloaded files from a local folder"""
+        prefix = os.path.join(local_dir, '')
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT local_path, checksum, sha256 FROM photos '
+                'WHERE download_status = ? AND substr(local_path, 1, ?) = ?',
+                (DONE, len(prefix), prefix)).fetchall()
+        return {row['local_path']: (row['checksum'], row['sha256']) for row in rows}
+
+    def find_content(self, sha256):
+        """Return remote path of already uploaded identical bytes, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT remote_path FROM contents WHERE sha256 = ?',
+                                   (sha256,)).fetchone()
+        return row['remote_path'] if row else None
+
+    def add_content(self, sha256, md5, size, remote_path):
+        """Remember where on Yandex Disk these bytes are stored"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO contents (sha256, md5, size, remote_path) '
+                'VALUES (?, ?, ?, ?)', (sha256, md5, size, remote_path))
+
+    def forget_content(self, sha256):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM contents WHERE sha256 = ?', (sha256,))
+
+    def exported_album(self, owner_id, album_id):
+        """Return the row of the last complete export of an album, or None"""
+        with self._lock:
+            return self._db.execute(
+                'SELECT * FROM albums WHERE owner_id = ? AND album_id = ?',
+                (str(owner_id), str(album_id))).fetchone()
+
+    def mark_album_exported(self, owner_id, album_id, title, vk_updated, size, size_policy,
+                            archive_mode, remote_path, public_url):
+        """Remember a complete export together with the VK state it was made from"""
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO albums (owner_id, album_id, title, vk_updated, size, '
+                'size_policy, archive_mode, remote_path, public_url, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(owner_id), str(album_id), title, vk_updated, size, size_policy,
+                 archive_mode, remote_path, public_url, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
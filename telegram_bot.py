@@ -2,43 +2,117 @@ import os
 import sys
 import re
 import shutil
+import asyncio
 from dotenv import load_dotenv
 from telegram import Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
 import vk_api
-import requests
-import datetime
-import yadisk
 
-from get_vk_session import get_vk_session
+import metrics
+from clients import clients
+from download_engine import DownloadEngine, DownloadTask
+from http_client import get_download_client, part_suffix
+from vk_photos import list_album_photos
+from album_metadata import get_album, list_owner_albums, prefetch_albums
+from photo_sizes import SizePolicy, default_size_policy
+from image_transform import ImageTransformer
+from upload_to_yandex_disk import (stream_photo_to_yandex_disk, upload_album, upload_album_archive,
+                                   spooled_upload_queue, spooled_download, publish_album,
+                                   streaming_mode, archive_mode, archive_extensions)
+from yandex_uploader import YandexUploader, UploadTask, UPLOADED, SKIPPED, DEDUPLICATED, FAILED
+from state_store import StateStore
+from album_jobs import AlbumJobQueue, AlbumJob
+from job_queue import SharedJobQueue
+from remote_index import RemoteIndex
+from spool import spool
 
 # Load environment variables
 load_dotenv()
 
 # Constants
 WAITING_FOR_ALBUM_URL = 1
+WAITING_FOR_BATCH = 2
 path_to_downloaded_albums = 'vk_downloaded_albums'
 
+# Albums one /batch message may queue, an owner with more is cut off
+batch_max_albums = int(os.getenv('BATCH_MAX_ALBUMS', '50'))
+
+# Leave album jobs to job_worker.py processes through the shared SQLite queue
+external_workers = os.getenv('EXTERNAL_WORKERS', '0') == '1'
+
+# Seconds between edits of the progress message
+progress_update_interval = float(os.getenv('PROGRESS_UPDATE_INTERVAL', '3'))
+
 # Progress tracking
 class ProgressTracker:
-    def __init__(self, chat_id, context):
+    """
+    Keeps a single progress message per job up to date
+
+    Workers only record the latest numbers; a background task edits the message
+    at most once per interval, so Telegram calls never slow down the transfer.
+    """
+    def __init__(self, chat_id, context, interval=None):
         self.chat_id = chat_id
         self.context = context
-        self.last_percent = 0
+        self.interval = interval or progress_update_interval
+        self.text = None
+        self._sent_text = None
+        self._message = None
+        self._task = None
+        self._lock = asyncio.Lock()
         
-    async def update_progress(self, current, total, stage_name):
-        """Send progress update every 10%"""
+    def update_progress(self, current, total, stage_name):
+        """Record progress, cheap and safe to call from worker threads"""
         if total == 0:
             return
         
         percent = int((current / total) * 100)
-        # Send update every 10%
-        if percent >= self.last_percent + 10 or percent == 100:
-            self.last_percent = percent
-            await self.context.bot.send_message(
-                chat_id=self.chat_id,
-                text=f"📊 {stage_name}: {percent}% ({current}/{total})"
-            )
+        self.text = f"📊 {stage_name}: {percent}% ({current}/{total})"
+    
+    def start(self):
+        """Start rendering, must be called from the running event loop"""
+        self._task = asyncio.create_task(self._render_loop())
+    
+    async def stop(self):
+        """Stop rendering and show the final state"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+    
+    async def _render_loop(self):
+        delay = 0
+        while True:
+            await asyncio.sleep(max(self.interval, delay))
+            delay = await self.flush()
+    
+    async def flush(self):
+        """
+        Post or edit the progress message if anything changed
+
+        Returns:
+            seconds Telegram asked to wait before the next update (0 if none)
+        """
+        async with self._lock:
+            text = self.text
+            if text is None or text == self._sent_text:
+                return 0
+            try:
+                if self._message is None:
+                    self._message = await self.context.bot.send_message(chat_id=self.chat_id, text=text)
+                else:
+                    await self.context.bot.edit_message_text(
+                        chat_id=self.chat_id, message_id=self._message.message_id, text=text)
+                self._sent_text = text
+            except RetryAfter as e:
+                # Flood control: drop this update, the render loop backs off
+                delay = e.retry_after
+                return delay.total_seconds() if hasattr(delay, 'total_seconds') else delay
+            except TelegramError as e:
+                print(f'Failed to update progress message: {e}')
+            return 0
 
 
 def process_url(url):
@@ -52,6 +126,40 @@ def process_url(url):
     return {'owner_id': owner_id, 'album_id': album_id}
 
 
+def process_owner_url(url):
+    """Extract owner_id from a VK link to all albums of a user or community"""
+    verification = re.compile(r'^https://vk\.(com|ru)/albums(-?[\d]+)$')
+    o = verification.match(url)
+    if not o:
+        raise ValueError('Invalid albums link')
+    return o.group(2)
+
+
+def album_job_key(job):
+    """Jobs for the same album and photo size share one execution"""
+    query = process_url(job.album_url)
+    return query['owner_id'], query['album_id'], str(job.size_policy or default_size_policy)
+
+
+def local_album_path(owner_id, album_id, size_policy):
+    """
+    Local folder of an album job, keyed like album_job_key instead of by title
+
+    Jobs for another size of the same album, or for another album with the
+    same title, may run at the same time and must not share or clean up each
+    other's files.
+    """
+    policy = re.sub(r'[^a-z0-9]+', '-', str(size_policy))
+    return f'{path_to_downloaded_albums}/{owner_id}_{album_id}_{policy}'
+
+
+def archive_title(title, size_policy):
+    """Name of an album archive without extension, other sizes get their own archive"""
+    if str(size_policy) == str(default_size_policy):
+        return title
+    return f'{title} ({size_policy})'
+
+
 def fix_illegal_album_title(title):
     """Replace illegal characters in album title"""
     illegal_character = '\/|:?<>*"'
@@ -60,30 +168,24 @@ def fix_illegal_album_title(title):
     return title
 
 
-def download_image(url, local_file_name):
-    """Download single image from URL"""
-    response = requests.get(url, stream=True)
-    if not response.ok:
-        return False
-    with open(local_file_name, 'wb') as file:
-        for chunk in response.iter_content(1024):
-            file.write(chunk)
-    return True
+async def download_album(album_url, chat_id, context, tracker, y=None, size_policy=None,
+                         uploader=None):
+    """
+    Download album from VK
 
-
-async def download_album(album_url, chat_id, context):
-    """Download album from VK"""
+    With a Yandex Disk client y photos are streamed straight into Yandex Disk.
+    With a YandexUploader every photo is uploaded as soon as it is on local disk
+    and deleted once the upload is confirmed (bounded by the shared spool).
+    """
+    size_policy = size_policy or default_size_policy
     try:
         query = process_url(album_url)
     except ValueError as e:
         await context.bot.send_message(chat_id=chat_id, text=f"❌ Error: {e}")
         return None
     
-    vk_session = get_vk_session()
-    
     try:
-        api = vk_session.get_api()
-        api.users.get(user_ids=1)
+        api = await asyncio.to_thread(clients.vk_api)
     except Exception as e:
         await context.bot.send_message(chat_id=chat_id, text=f"❌ VK authentication failed: {e}")
         return None
@@ -92,21 +194,27 @@ async def download_album(album_url, chat_id, context):
     a = query['album_id']
     
     try:
-        album = api.photos.getAlbums(owner_id=o, album_ids=a)['items'][0]
+        # Refreshed: a job_worker.py process keeps its album cache for its whole life
+        album = await asyncio.to_thread(get_album, api, o, a, True)
+        if album is None:
+            await context.bot.send_message(chat_id=chat_id, text="❌ Album not found")
+            return None
         title = album['title']
         title = fix_illegal_album_title(title)
         images_num = album['size']
-        photos = api.photos.get(owner_id=o, album_id=a, photo_sizes=1, count=images_num)['items']
+        photos = await asyncio.to_thread(list_album_photos, api, o, a)
     except vk_api.exceptions.ApiError as e:
+        clients.report_error(e)
         await context.bot.send_message(chat_id=chat_id, text=f"❌ VK API error: {e}")
         return None
     
-    album_path = path_to_downloaded_albums + '/' + title
-    if not os.path.exists(album_path):
-        os.makedirs(album_path)
+    if y:
+        remote_album_path = f"{os.getenv('YANDEX_DISK_PATH', '/VK_Albums')}/{title}"
+        album_path = remote_album_path
     else:
-        album_path += '.copy_{:%Y-%m-%d_%H-%M-%S}'.format(datetime.datetime.now())
-        os.makedirs(album_path)
+        # Reuse the folder of an earlier run, finished photos are skipped below
+        album_path = local_album_path(o, a, size_policy)
+        os.makedirs(album_path, exist_ok=True)
     
     await context.bot.send_message(
         chat_id=chat_id,
@@ -114,40 +222,154 @@ async def download_album(album_url, chat_id, context):
         parse_mode='Markdown'
     )
     
-    tracker = ProgressTracker(chat_id, context)
+    state = StateStore()
+    known_photos = state.album_photos(o, a)
+    # (url, path) of the chosen size, the file name tells sizes apart
+    sources = [(url, album_path + '/' + file_name)
+               for url, file_name in (size_policy.choose(p) for p in photos)]
+    tasks = []
+    photo_ids = []
     
-    for i, p in enumerate(photos, 1):
-        largest_image_width = p['sizes'][0]['width']
-        largest_image_src = p['sizes'][0]['url']
+    # An archive is rebuilt whole, so photos already inside it are fetched
+    # again unless the archive holds every photo of the album
+    rebuild_archive = False
+    if archive_mode and not y and not uploader:
+        remote_archive_path = (f"{os.getenv('YANDEX_DISK_PATH', '/VK_Albums')}/"
+                               f"{archive_title(title, size_policy)}"
+                               + archive_extensions[archive_mode])
+        rebuild_archive = not all(
+            state.is_uploaded(known_photos.get(str(p['id'])), remote_archive_path, photo_path)
+            for p, (_, photo_path) in zip(photos, sources))
+    
+    if uploader:
+        remote_album_path = f"{os.getenv('YANDEX_DISK_PATH', '/VK_Albums')}/{title}"
+        await asyncio.to_thread(ensure_remote_dirs, uploader.index, remote_album_path)
+        upload_queue = spooled_upload_queue(uploader, state)
+        leftovers = 0
+    
+    for p, (image_src, photo_path) in zip(photos, sources):
+        row = known_photos.get(str(p['id']))
         
-        if largest_image_width == 0:
-            largest_image_src = p['sizes'][len(p['sizes']) - 1]['url']
-        else:
-            for size in p['sizes']:
-                if size['width'] > largest_image_width:
-                    largest_image_width = size['width']
-                    largest_image_src = size['url']
+        # Skip photos finished by an earlier (possibly interrupted) run at this size
+        if y and state.is_uploaded(row, photo_path):
+            continue
+        if not y and state.is_uploaded(row, photo_path=photo_path) and not rebuild_archive:
+            continue
+        if uploader and state.is_downloaded(row, photo_path):
+            # Left on disk by an interrupted job, only the upload is missing
+            spool.add(row['local_path'], row['size'])
+            upload_queue.submit(UploadTask(
+                row['local_path'],
+                remote_album_path + '/' + os.path.basename(row['local_path']),
+                row['checksum'], row['sha256']))
+            leftovers += 1
+            continue
+        if not y and state.is_downloaded(row, photo_path):
+            continue
+        tasks.append(DownloadTask(image_src, photo_path))
+        photo_ids.append(p['id'])
+    
+    # Run the worker pool off the event loop, the tracker only records progress
+    loop = asyncio.get_running_loop()
+    
+    def report_progress(done, total):
+        tracker.update_progress(done, total, "Downloading")
+    
+    if y:
+        await asyncio.to_thread(ensure_remote_dirs, RemoteIndex(y), album_path)
+        engine = DownloadEngine(
+            lambda url, remote_path: stream_photo_to_yandex_disk(y, url, remote_path, state))
+        results = await loop.run_in_executor(None, engine.download, tasks, report_progress)
+        # One transaction off the event loop, per-photo commits would stall it
+        await asyncio.to_thread(state.mark_many, o, a, uploaded=[
+            (photo_id, task.path)
+            for task, photo_id, result in zip(tasks, photo_ids, results) if result])
+        await tracker.flush()
+        uploaded = sum(1 for r in results if r)
+        return {'path': None, 'remote_path': album_path, 'title': title,
+                'count': images_num, 'uploaded': uploaded,
+                'skipped': len(photos) - len(tasks), 'failed': len(tasks) - uploaded}
+    
+    # Optional re-encoding (RECOMPRESS_FORMAT) in the shared process pool
+    transformer = ImageTransformer()
+    
+    if uploader:
+        photo_by_path = dict(zip((task.path for task in tasks), photo_ids))
         
-        extension = os.path.splitext(largest_image_src)[-1].split('?')[0]
-        download_image(largest_image_src, album_path + '/' + str(p['id']) + extension)
+        def on_downloaded(path, local_path, result):
+            state.mark_downloaded(o, a, photo_by_path[path], local_path, result.size,
+                                  result.md5, result.sha256)
         
-        await tracker.update_progress(i, images_num, "Downloading")
+        engine = DownloadEngine(spooled_download(
+            get_download_client().download, upload_queue,
+            lambda path: remote_album_path + '/' + os.path.basename(path),
+            on_downloaded, transformer))
+        results = await loop.run_in_executor(None, engine.download, tasks, report_progress)
+        failed = [(photo_id, task.path)
+                  for task, photo_id, result in zip(tasks, photo_ids, results) if not result]
+        await asyncio.to_thread(state.mark_many, o, a, download_failed=failed)
+        download_failed = len(failed)
+        stats = await asyncio.to_thread(upload_queue.close)
+        await tracker.flush()
+        return {'path': album_path, 'remote_path': remote_album_path, 'title': title,
+                'count': images_num, 'uploaded': stats[UPLOADED],
+                'skipped': stats[SKIPPED] + stats[DEDUPLICATED] + len(photos) - len(tasks) - leftovers,
+                'failed': stats[FAILED], 'download_failed': download_failed,
+                'recompressed': transformer.report() if transformer.original_bytes else None}
+    
+    engine = DownloadEngine(get_download_client().download)
+    results = await loop.run_in_executor(None, engine.download, tasks, report_progress)
     
-    return {'path': album_path, 'title': title, 'count': images_num}
+    if transformer.enabled:
+        def report_recompress(done, total):
+            tracker.update_progress(done, total, "Recompressing")
+        
+        tasks, results = await loop.run_in_executor(
+            None, transformer.transform_downloads, tasks, results, report_recompress)
+    
+    downloaded = []
+    failed = []
+    for task, photo_id, result in zip(tasks, photo_ids, results):
+        if result:
+            downloaded.append((photo_id, task.path, result.size, result.md5, result.sha256))
+        else:
+            failed.append((photo_id, task.path))
+    await asyncio.to_thread(state.mark_many, o, a, downloaded=downloaded,
+                            download_failed=failed)
+    download_failed = len(failed)
+    
+    await tracker.flush()
+    
+    return {'path': album_path, 'title': title, 'count': images_num,
+            'archive_title': archive_title(title, size_policy),
+            'download_failed': download_failed,
+            'recompressed': transformer.report() if transformer.original_bytes else None}
 
 
-async def upload_album_to_yandex(album_info, chat_id, context):
-    """Upload album to Yandex Disk"""
-    token = os.getenv('YANDEX_DISK_TOKEN')
-    
-    if not token:
-        await context.bot.send_message(chat_id=chat_id, text="❌ Yandex Disk token not configured")
+async def get_yandex_client(chat_id, context):
+    """Get the shared Yandex Disk client, reports to the chat and returns None on failure"""
+    try:
+        return await asyncio.to_thread(clients.yandex_disk)
+    except ValueError as e:
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ {e}")
         return None
+
+
+def ensure_remote_dirs(remote_index, remote_album_path):
+    """Create base and album directories on Yandex Disk if needed"""
+    yandex_disk_path = os.getenv('YANDEX_DISK_PATH', '/VK_Albums')
     
-    y = yadisk.YaDisk(token=token)
+    # Create base directory if needed
+    remote_index.ensure_dir(yandex_disk_path)
     
-    if not y.check_token():
-        await context.bot.send_message(chat_id=chat_id, text="❌ Invalid Yandex Disk token")
+    # Create album directory
+    remote_index.ensure_dir(remote_album_path)
+
+
+async def upload_album_to_yandex(album_info, chat_id, context, tracker):
+    """Upload album to Yandex Disk"""
+    y = await get_yandex_client(chat_id, context)
+    if not y:
         return None
     
     yandex_disk_path = os.getenv('YANDEX_DISK_PATH', '/VK_Albums')
@@ -155,13 +377,41 @@ async def upload_album_to_yandex(album_info, chat_id, context):
     local_album_path = album_info['path']
     remote_album_path = f'{yandex_disk_path}/{album_title}'
     
-    # Create base directory if needed
-    if not y.exists(yandex_disk_path):
-        y.mkdir(yandex_disk_path)
+    state = StateStore()
+    uploader = YandexUploader(y, content_index=state)
     
-    # Create album directory
-    if not y.exists(remote_album_path):
-        y.mkdir(remote_album_path)
+    photos = [f for f in os.listdir(local_album_path) 
+              if os.path.isfile(os.path.join(local_album_path, f))
+              and not f.endswith(part_suffix)]
+    
+    # Upload in parallel off the event loop, the tracker only records progress
+    loop = asyncio.get_running_loop()
+    
+    def report_progress(done, total):
+        tracker.update_progress(done, total, "Uploading")
+    
+    if archive_mode:
+        # One archive per album: a single upload, and the link downloads everything
+        await asyncio.to_thread(uploader.index.ensure_dir, yandex_disk_path)
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"☁️ Uploading to Yandex Disk as one {archive_mode.upper()} archive...",
+        )
+        status, remote_archive_path = await loop.run_in_executor(
+            None, upload_album_archive, y, local_album_path,
+            f"{yandex_disk_path}/{album_info['archive_title']}", photos, report_progress, state)
+        await tracker.flush()
+        if status == FAILED:
+            await context.bot.send_message(chat_id=chat_id, text="⚠️ Failed to upload the album archive")
+            return None
+        return {
+            'uploaded': len(photos) if status == UPLOADED else 0,
+            'skipped': len(photos) if status == SKIPPED else 0,
+            'public_url': await asyncio.to_thread(publish_album, y, remote_archive_path),
+            'remote_path': remote_archive_path
+        }
+    
+    await asyncio.to_thread(ensure_remote_dirs, uploader.index, remote_album_path)
     
     await context.bot.send_message(
         chat_id=chat_id,
@@ -169,48 +419,20 @@ async def upload_album_to_yandex(album_info, chat_id, context):
         parse_mode='Markdown'
     )
     
-    photos = [f for f in os.listdir(local_album_path) 
-              if os.path.isfile(os.path.join(local_album_path, f))]
-    
-    tracker = ProgressTracker(chat_id, context)
-    uploaded_count = 0
-    skipped_count = 0
+    stats = await loop.run_in_executor(None, upload_album, uploader, local_album_path,
+                                       remote_album_path, photos, report_progress, state)
+    await tracker.flush()
     
-    for i, photo_name in enumerate(photos, 1):
-        local_photo_path = os.path.join(local_album_path, photo_name)
-        remote_photo_path = f'{remote_album_path}/{photo_name}'
-        
-        # Check if already exists
-        if y.exists(remote_photo_path):
-            local_size = os.path.getsize(local_photo_path)
-            remote_info = y.get_meta(remote_photo_path)
-            
-            if remote_info.size == local_size:
-                skipped_count += 1
-                await tracker.update_progress(i, len(photos), "Uploading")
-                continue
-        
-        try:
-            y.upload(local_photo_path, remote_photo_path, overwrite=True)
-            uploaded_count += 1
-        except Exception as e:
-            await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Error uploading {photo_name}: {e}")
-            continue
-        
-        await tracker.update_progress(i, len(photos), "Uploading")
+    if stats[FAILED] > 0:
+        await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Failed to upload {stats[FAILED]} photo(s)")
     
     # Get public link
-    try:
-        if not y.is_public(remote_album_path):
-            y.publish(remote_album_path)
-        meta = y.get_meta(remote_album_path)
-        public_url = meta.public_url
-    except Exception:
-        public_url = None
+    public_url = await asyncio.to_thread(publish_album, y, remote_album_path)
     
     return {
-        'uploaded': uploaded_count,
-        'skipped': skipped_count,
+        'uploaded': stats[UPLOADED],
+        'skipped': stats[SKIPPED] + stats[DEDUPLICATED],
+        'failed': stats[FAILED],
         'public_url': public_url,
         'remote_path': remote_album_path
     }
@@ -228,6 +450,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👋 Welcome to VK Album Downloader Bot!\n\n"
         "Available commands:\n"
         "/download - Download and upload an album\n"
+        "/download max width 1280 - Same, with smaller photos\n"
+        "/batch - Download many albums or all albums of an owner\n"
         "/help - Show this help message\n\n"
         "Send /download to get started!"
     )
@@ -245,13 +469,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "   • Upload it to Yandex Disk\n"
         "   • Clean up local files\n"
         "4️⃣ Get the public link to your album!\n\n"
-        "💡 *Progress updates every 10%*"
+        "📦 *Many albums:* send /batch with several album URLs, or\n"
+        "`https://vk.com/albums-123456789` for all albums of an owner\n\n"
+        "📐 *Photo size:* add a policy after /download or the URL:\n"
+        "`max`, `max width 1280` or VK size types like `z,y,x`\n\n"
+        "💡 *A single progress message is kept up to date*"
     )
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
 
 async def download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /download command"""
+    """Handle /download command, optionally followed by a photo size policy"""
+    try:
+        context.user_data['size_policy'] = (SizePolicy.parse(' '.join(context.args))
+                                            if context.args else None)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return ConversationHandler.END
+    
     await update.message.reply_text(
         "📎 Please send me the VK album URL\n\n"
         "Example: `https://vk.com/album-123456789_987654321`\n\n"
@@ -264,7 +499,7 @@ async def download_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_album_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle album URL and start workflow"""
     try:
-        album_url = update.message.text.strip()
+        album_url, _, policy = update.message.text.strip().partition(' ')
         chat_id = update.effective_chat.id
         
         # Validate URL
@@ -280,32 +515,328 @@ async def handle_album_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return WAITING_FOR_ALBUM_URL
         
-        await update.message.reply_text("🚀 Starting workflow...")
-        
-        # Step 1: Download
-        await context.bot.send_message(chat_id=chat_id, text="━━━━━ STEP 1: DOWNLOAD ━━━━━")
-        album_info = await download_album(album_url, chat_id, context)
-        
-        if not album_info:
-            await update.message.reply_text("❌ Download failed. Workflow stopped.")
-            return ConversationHandler.END
-        
-        await context.bot.send_message(chat_id=chat_id, text="✅ Download completed!")
-        
-        # Step 2: Upload
-        await context.bot.send_message(chat_id=chat_id, text="\n━━━━━ STEP 2: UPLOAD ━━━━━")
-        upload_result = await upload_album_to_yandex(album_info, chat_id, context)
+        # A policy after the URL wins over the one given with /download
+        try:
+            size_policy = SizePolicy.parse(policy) if policy else context.user_data.get('size_policy')
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}\n\nOr send /cancel to cancel")
+            return WAITING_FOR_ALBUM_URL
         
-        if not upload_result:
-            await update.message.reply_text("❌ Upload failed. Local files preserved.")
+        # Hand the album over to the background workers and free the handler
+        context.user_data.pop('size_policy', None)
+        job = AlbumJob(album_url, chat_id, context, size_policy)
+        if await answer_from_export(job):
             return ConversationHandler.END
+        ahead = await album_jobs.submit(job)
+        if ahead is None:
+            await update.message.reply_text(
+                "🔁 This album is already being processed, you will get the same link when it is done")
+        elif ahead:
+            await update.message.reply_text(f"⏳ Album queued, {ahead} album(s) ahead of it")
+        else:
+            await update.message.reply_text("🚀 Starting workflow...")
         
-        await context.bot.send_message(chat_id=chat_id, text="✅ Upload completed!")
+        return ConversationHandler.END
         
-        # Step 3: Cleanup
-        await context.bot.send_message(chat_id=chat_id, text="\n━━━━━ STEP 3: CLEANUP ━━━━━")
-        clear_local_album(album_info['path'])
-        await context.bot.send_message(chat_id=chat_id, text="✅ Local files cleaned up!")
+    except Exception as e:
+        print(f'❌ Error in handle_album_url: {e}')
+        await update.message.reply_text(
+            f"❌ An unexpected error occurred: {str(e)}\n\n"
+            "Please try again or contact the administrator."
+        )
+        return ConversationHandler.END
+
+
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /batch command, the links may follow it or come in the next message"""
+    if context.args:
+        await queue_batch(update, context, context.args)
+        return ConversationHandler.END
+    
+    await update.message.reply_text(
+        "📎 Please send me VK album URLs, one per line, or a link to all albums of an owner\n\n"
+        "Example: `https://vk.com/albums-123456789`\n\n"
+        "Send /cancel to cancel",
+        parse_mode='Markdown'
+    )
+    return WAITING_FOR_BATCH
+
+
+async def handle_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the list of links sent after /batch"""
+    await queue_batch(update, context, update.message.text.split())
+    return ConversationHandler.END
+
+
+async def queue_batch(update, context, links):
+    """Expand owner links to their albums and queue every album through the shared workers"""
+    chat_id = update.effective_chat.id
+    album_urls = []
+    # Albums from owner listings, their info was fetched just now
+    listed = set()
+    invalid = []
+    for link in links:
+        try:
+            process_url(link)
+            album_urls.append(link)
+            continue
+        except ValueError:
+            pass
+        try:
+            owner_id = process_owner_url(link)
+        except ValueError:
+            invalid.append(link)
+            continue
+        try:
+            api = await asyncio.to_thread(clients.vk_api)
+            albums = await asyncio.to_thread(list_owner_albums, api, owner_id)
+        except Exception as e:
+            clients.report_error(e)
+            await update.message.reply_text(f"❌ Could not list albums of {link}: {e}")
+            continue
+        urls = [f"https://vk.com/album{album['owner_id']}_{album['id']}" for album in albums]
+        album_urls.extend(urls)
+        listed.update(urls)
+    
+    # The same album twice in one batch is queued once
+    album_urls = list(dict.fromkeys(album_urls))
+    if len(album_urls) > batch_max_albums:
+        await update.message.reply_text(
+            f"⚠️ {len(album_urls)} albums found, only the first {batch_max_albums} are queued")
+        album_urls = album_urls[:batch_max_albums]
+    
+    if invalid:
+        await update.message.reply_text("❌ Skipped invalid link(s):\n" + '\n'.join(invalid))
+    if not album_urls:
+        await update.message.reply_text("❌ No albums to download")
+        return
+    
+    # The handler blocks the bot: one photos.getAlbums per owner refreshes the
+    # explicit links (owner listings are fresh already) instead of one per album
+    try:
+        api = await asyncio.to_thread(clients.vk_api)
+        await asyncio.to_thread(prefetch_albums, api,
+                                [process_url(url) for url in album_urls if url not in listed],
+                                None, True)
+        looked_up = True
+    except Exception as e:
+        # The jobs sync the albums anyway, the state store limits them to the delta
+        clients.report_error(e)
+        print(f'Album lookup failed for a batch: {e}')
+        looked_up = False
+    
+    queued = shared = unchanged = 0
+    for album_url in album_urls:
+        job = AlbumJob(album_url, chat_id, context)
+        if looked_up and await answer_from_export(job, refresh=False):
+            unchanged += 1
+            continue
+        ahead = await album_jobs.submit(job)
+        if ahead is None:
+            shared += 1
+        else:
+            queued += 1
+    
+    message = f"📦 Batch: {queued} album(s) queued"
+    if unchanged:
+        message += f", {unchanged} unchanged since the last export"
+    if shared:
+        message += f", {shared} already in progress (you will get the same links)"
+    await update.message.reply_text(message)
+
+
+async def share_album_result(job, result):
+    """Send the result of a shared execution to a request that joined it"""
+    if result:
+        await job.context.bot.send_message(chat_id=job.chat_id, text=result, parse_mode='Markdown')
+    else:
+        await job.context.bot.send_message(
+            chat_id=job.chat_id,
+            text=f"❌ Could not process {job.album_url}\n\nPlease try again or contact the administrator."
+        )
+
+
+async def find_exported_album(job, refresh=True):
+    """
+    Look the album up on VK once and compare it with its last complete export
+
+    refresh=False trusts an album info cached moments ago (e.g. by an owner listing).
+
+    Returns:
+        export row if the album is unchanged since, else None
+    """
+    query = process_url(job.album_url)
+    try:
+        api = await asyncio.to_thread(clients.vk_api)
+        # The current updated / size decide whether the export still matches
+        album = await asyncio.to_thread(get_album, api, query['owner_id'], query['album_id'],
+                                        refresh)
+    except Exception as e:
+        # The regular workflow reports VK errors to the chat
+        print(f'Album lookup failed for {job.album_url}: {e}')
+        return None
+    if album is None:
+        return None
+    
+    export = await asyncio.to_thread(StateStore().exported_album,
+                                     query['owner_id'], query['album_id'])
+    if (export is not None and export['vk_updated'] == album.get('updated')
+            and export['size'] == album['size']
+            and export['size_policy'] == str(job.size_policy or default_size_policy)
+            and export['archive_mode'] == archive_mode):
+        return export
+    return None
+
+
+async def answer_from_export(job, refresh=True):
+    """
+    Answer a request from the last complete export if the album is unchanged
+
+    Runs before the job is queued, so an unchanged album never waits for a worker.
+
+    Returns:
+        True if the chat got its answer and no job is needed
+    """
+    export = await find_exported_album(job, refresh)
+    if not export:
+        metrics.result_cache.inc(result='miss')
+        return False
+    # Unchanged since the last export: one VK call, no download or upload
+    metrics.result_cache.inc(result='hit')
+    message = (
+        "\n⚡ *ALBUM UNCHANGED SINCE THE LAST EXPORT*\n\n"
+        f"📁 Album: *{export['title']}*\n"
+        f"📸 Photos: {export['size']}\n"
+    )
+    if export['public_url']:
+        message += f"\n🔗 *Public link:*\n{export['public_url']}"
+    else:
+        message += f"\n📂 *Path:* `{export['remote_path']}`"
+    await job.context.bot.send_message(chat_id=job.chat_id, text=message, parse_mode='Markdown')
+    return True
+
+
+def remember_export(job, album_info, upload_result):
+    """Store a complete export so unchanged albums are answered without a sync"""
+    if (album_info.get('failed') or album_info.get('download_failed')
+            or upload_result.get('failed')):
+        return
+    query = process_url(job.album_url)
+    # Refreshed by download_album right before the photos were listed
+    album = get_album(clients.vk_api(), query['owner_id'], query['album_id'])
+    if album is None:
+        return
+    StateStore().mark_album_exported(
+        album['owner_id'], album['id'], album_info['title'], album.get('updated'),
+        album['size'], str(job.size_policy or default_size_policy), archive_mode,
+        upload_result['remote_path'], upload_result['public_url'])
+
+
+async def process_album_job(job):
+    """
+    Run download → upload → cleanup for a queued album
+
+    Returns:
+        the final message on success, shared with identical requests; None on a
+        failure already reported to the chat
+
+    Raises:
+        unexpected errors, after reporting them, so job_worker.py can run the job again
+    """
+    album_url = job.album_url
+    chat_id = job.chat_id
+    context = job.context
+    tracker = ProgressTracker(chat_id, context)
+    tracker.start()
+    try:
+        # Changed or never exported (checked before queueing): the state store
+        # limits the sync to the delta
+        if streaming_mode:
+            # Single step: photos go from VK straight into Yandex Disk
+            await context.bot.send_message(chat_id=chat_id, text="━━━━━ STEP 1: STREAM TO YANDEX DISK ━━━━━")
+            y = await get_yandex_client(chat_id, context)
+            album_info = await download_album(album_url, chat_id, context, tracker, y=y,
+                                              size_policy=job.size_policy) if y else None
+            
+            if not album_info:
+                await context.bot.send_message(chat_id=chat_id, text="❌ Streaming failed. Workflow stopped.")
+                return
+            
+            upload_result = {
+                'uploaded': album_info['uploaded'],
+                'skipped': album_info['skipped'],
+                'public_url': await asyncio.to_thread(publish_album, y, album_info['remote_path']),
+                'remote_path': album_info['remote_path']
+            }
+            await context.bot.send_message(chat_id=chat_id, text="✅ Upload completed!")
+        elif not archive_mode:
+            # Step 1: photos are uploaded while the album downloads and deleted once
+            # confirmed, so the album never sits on local disk as a whole
+            await context.bot.send_message(chat_id=chat_id, text="━━━━━ STEP 1: DOWNLOAD & UPLOAD ━━━━━")
+            y = await get_yandex_client(chat_id, context)
+            uploader = YandexUploader(y, content_index=StateStore()) if y else None
+            album_info = await download_album(album_url, chat_id, context, tracker,
+                                              size_policy=job.size_policy,
+                                              uploader=uploader) if y else None
+            
+            if not album_info:
+                await context.bot.send_message(chat_id=chat_id, text="❌ Sync failed. Workflow stopped.")
+                return
+            
+            if album_info['failed'] > 0:
+                await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Failed to upload {album_info['failed']} photo(s)")
+            
+            upload_result = {
+                'uploaded': album_info['uploaded'],
+                'skipped': album_info['skipped'],
+                'public_url': await asyncio.to_thread(publish_album, y, album_info['remote_path']),
+                'remote_path': album_info['remote_path']
+            }
+            await context.bot.send_message(chat_id=chat_id, text="✅ Upload completed!")
+            
+            # Step 2: Cleanup of the empty folder; photos whose upload or download
+            # failed stay on disk so the next run resumes them
+            await context.bot.send_message(chat_id=chat_id, text="\n━━━━━ STEP 2: CLEANUP ━━━━━")
+            if album_info['failed'] or album_info['download_failed']:
+                await context.bot.send_message(chat_id=chat_id, text="⚠️ Some photos failed. Local files preserved.")
+            else:
+                await asyncio.to_thread(clear_local_album, album_info['path'])
+                await context.bot.send_message(chat_id=chat_id, text="✅ Local files cleaned up!")
+        else:
+            # Archives are built from whole albums, so the album is downloaded first
+            # Step 1: Download
+            await context.bot.send_message(chat_id=chat_id, text="━━━━━ STEP 1: DOWNLOAD ━━━━━")
+            album_info = await download_album(album_url, chat_id, context, tracker,
+                                              size_policy=job.size_policy)
+            
+            if not album_info:
+                await context.bot.send_message(chat_id=chat_id, text="❌ Download failed. Workflow stopped.")
+                return
+            
+            if album_info['download_failed']:
+                # An archive without them would replace the complete one on the disk
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text=f"❌ Failed to download {album_info['download_failed']} photo(s). "
+                         "Archive not uploaded, local files preserved.")
+                return
+            
+            await context.bot.send_message(chat_id=chat_id, text="✅ Download completed!")
+            
+            # Step 2: Upload
+            await context.bot.send_message(chat_id=chat_id, text="\n━━━━━ STEP 2: UPLOAD ━━━━━")
+            upload_result = await upload_album_to_yandex(album_info, chat_id, context, tracker)
+            
+            if not upload_result:
+                await context.bot.send_message(chat_id=chat_id, text="❌ Upload failed. Local files preserved.")
+                return
+            
+            await context.bot.send_message(chat_id=chat_id, text="✅ Upload completed!")
+            
+            # Step 3: Cleanup
+            await context.bot.send_message(chat_id=chat_id, text="\n━━━━━ STEP 3: CLEANUP ━━━━━")
+            await asyncio.to_thread(clear_local_album, album_info['path'])
+            await context.bot.send_message(chat_id=chat_id, text="✅ Local files cleaned up!")
         
         # Final success message
         success_message = (
@@ -315,23 +846,36 @@ async def handle_album_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"📤 Uploaded: {upload_result['uploaded']} new\n"
             f"⊘ Skipped: {upload_result['skipped']} existing\n"
         )
+        if album_info.get('recompressed'):
+            success_message += f"🗜 {album_info['recompressed']}\n"
         
         if upload_result['public_url']:
             success_message += f"\n🔗 *Public link:*\n{upload_result['public_url']}"
         else:
             success_message += f"\n📂 *Path:* `{upload_result['remote_path']}`"
         
-        await update.message.reply_text(success_message, parse_mode='Markdown')
-        
-        return ConversationHandler.END
+        await context.bot.send_message(chat_id=chat_id, text=success_message, parse_mode='Markdown')
+        await asyncio.to_thread(remember_export, job, album_info, upload_result)
+        return success_message
         
     except Exception as e:
-        print(f'❌ Error in handle_album_url: {e}')
-        await update.message.reply_text(
-            f"❌ An unexpected error occurred: {str(e)}\n\n"
-            "Please try again or contact the administrator."
+        clients.report_error(e)
+        print(f'❌ Error in process_album_job: {e}')
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ An unexpected error occurred: {str(e)}\n\n"
+                 "Please try again or contact the administrator."
         )
-        return ConversationHandler.END
+        # The job queue decides whether the job runs again
+        raise
+    finally:
+        await tracker.stop()
+
+
+if external_workers:
+    album_jobs = SharedJobQueue(album_job_key)
+else:
+    album_jobs = AlbumJobQueue(process_album_job, key=album_job_key, share=share_album_result)
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -365,6 +909,21 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f'Error in error handler: {e}')
 
 
+async def post_init(application):
+    """Start background album workers once the event loop is running"""
+    album_jobs.start()
+    if external_workers:
+        print('📮 Album jobs are queued for job_worker.py processes')
+    if metrics.metrics_port:
+        metrics.registry.serve(metrics.metrics_port)
+        print(f'📈 Metrics available on port {metrics.metrics_port} at /metrics')
+
+
+async def post_shutdown(application):
+    """Stop background album workers"""
+    await album_jobs.stop()
+
+
 def main():
     """Start the bot"""
     token = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -376,15 +935,20 @@ def main():
         sys.exit(1)
     
     # Create application
-    application = Application.builder().token(token).build()
+    application = (Application.builder().token(token)
+                   .post_init(post_init).post_shutdown(post_shutdown).build())
     
     # Add conversation handler
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('download', download_command)],
+        entry_points=[CommandHandler('download', download_command),
+                      CommandHandler('batch', batch_command)],
         states={
             WAITING_FOR_ALBUM_URL: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_album_url)
             ],
+            WAITING_FOR_BATCH: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_batch)
+            ],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
     )
@@ -1,14 +1,34 @@
-import yadisk
 import os
 import sys
+import time
+import random
+import tarfile
+import zipfile
+import threading
 from dotenv import load_dotenv
 
+import metrics
+from download_engine import DownloadTask
+from http_client import get_download_client, part_suffix, HashingReader
+from clients import clients
+from yandex_uploader import (YandexUploader, UploadQueue, UploadTask, UPLOADED, SKIPPED,
+                             DEDUPLICATED, FAILED, upload_retries, upload_backoff)
+from state_store import StateStore
+from spool import spool as default_spool
+
 # Load environment variables
 load_dotenv()
 
 # Path to downloaded albums
 path_to_downloaded_albums = 'vk_downloaded_albums'
 
+# Pipe photos from VK straight into Yandex Disk instead of staging them on local disk
+streaming_mode = os.getenv('STREAMING_MODE', '0') == '1'
+
+# Upload every album as one archive instead of one file per photo: zip, tar or empty
+archive_mode = os.getenv('ARCHIVE_MODE', '').lower()
+archive_extensions = {'zip': '.zip', 'tar': '.tar'}
+
 
 def print_progress(value, end_value, bar_length=20):
     """Display upload progress bar"""
@@ -32,15 +52,246 @@ def get_yandex_disk_client():
         print('Get your token from: https://yandex.ru/dev/disk/poligon/')
         sys.exit(1)
     
-    y = yadisk.YaDisk(token=token)
-    
-    # Check if token is valid
-    if not y.check_token():
+    # Check if token is valid (the client is shared and re-checked only on a TTL)
+    try:
+        return clients.yandex_disk()
+    except ValueError:
         print('Error: Invalid Yandex Disk token')
         print('Please check your token in the .env file')
         sys.exit(1)
+
+
+def stream_photo_to_yandex_disk(y, url, remote_photo_path, state=None):
+    """
+    Upload a photo to Yandex Disk directly from its VK response body
+
+    Checksums are computed while the body streams through and, with a state
+    store, recorded in its content index for later deduplication.
+    """
+    client = get_download_client()
+    for attempt in range(client.retries + 1):
+        try:
+            # CDN and Yandex time overlap here, so the whole transfer counts as an upload
+            with metrics.yandex_upload_seconds.time(), client.open_stream(url) as response:
+                reader = HashingReader(response.raw)
+                # A consumed stream can't be replayed, so retries re-fetch from VK instead
+                y.upload(reader, remote_photo_path, overwrite=True, n_retries=0)
+            result = reader.result()
+            metrics.transferred_bytes.inc(result.size, stage='cdn')
+            metrics.transferred_bytes.inc(result.size, stage='yandex')
+            metrics.transfers.inc(stage='stream', status='ok')
+            if state:
+                state.add_content(result.sha256, result.md5, result.size, remote_photo_path)
+            return result
+        except Exception as e:
+            if attempt == client.retries:
+                print(f'\nError streaming {remote_photo_path}: {e}')
+            else:
+                metrics.retries.inc(stage='stream')
+    metrics.transfers.inc(stage='stream', status='failed')
+    return False
+
+
+def upload_album(uploader, local_album_path, remote_album_path, photos, progress=None, state=None):
+    """
+    Upload photos of one local album folder
+
+    Photos the state store already records as uploaded to the same remote path
+    are skipped without any API call, results are written back to the store.
+
+    Returns:
+        Counter with the number of UPLOADED / SKIPPED / DEDUPLICATED / FAILED files
+    """
+    uploaded = state.uploaded_files(local_album_path) if state else {}
+    # Checksums recorded while downloading save the uploader from re-reading files
+    hashes = state.file_hashes(local_album_path) if state else {}
+    tasks = []
+    skipped_count = 0
+    for photo_name in photos:
+        local_photo_path = os.path.join(local_album_path, photo_name)
+        task = UploadTask(local_photo_path, f'{remote_album_path}/{photo_name}',
+                          *hashes.get(local_photo_path, (None, None)))
+        if uploaded.get(task.local_path) == task.remote_path:
+            skipped_count += 1
+        else:
+            tasks.append(task)
     
-    return y
+    def on_result(task, status):
+        if state and status != FAILED:
+            state.mark_uploaded_by_path(task.local_path, task.remote_path)
+    
+    stats = uploader.upload(tasks, progress, on_result)
+    stats[SKIPPED] += skipped_count
+    return stats
+
+
+def release_uploaded(state=None, spool=None):
+    """
+    Return on_result(task, status) that deletes a photo once its upload is confirmed
+
+    Photos whose upload failed stay on disk for the next run, but their bytes
+    are freed from the spool budget so downloads can go on.
+    """
+    spool = spool or default_spool
+
+    def on_result(task, status):
+        if state and status != FAILED:
+            state.mark_uploaded_by_path(task.local_path, task.remote_path)
+        spool.release(task.local_path, delete=status != FAILED)
+
+    return on_result
+
+
+def spooled_upload_queue(uploader, state=None, spool=None):
+    """UploadQueue that deletes every photo from local disk once its upload is confirmed"""
+    return UploadQueue(uploader, release_uploaded(state, spool))
+
+
+def spooled_download(download_func, upload_queue, remote_path_for, on_downloaded=None,
+                     transformer=None, spool=None):
+    """
+    Wrap a DownloadEngine download function so photos are uploaded as soon as they are on disk
+
+    Downloads wait while the spool budget is used up. Uploads submitted to
+    upload_queue have to end in release_uploaded so they give the room back.
+
+    Args:
+        remote_path_for: function returning the Yandex Disk path of a local file
+        on_downloaded: optional callback on_downloaded(path, local_path, result) with
+            the task path and the final file (they differ after recompression), called
+            before the upload is queued
+        transformer: optional ImageTransformer applied to every photo before upload
+    """
+    spool = spool or default_spool
+
+    def download(url, path):
+        spool.wait_for_room()
+        result = download_func(url, path)
+        if not result:
+            return result
+        local_path = path
+        if transformer and transformer.enabled:
+            (task,), (result,) = transformer.transform_downloads(
+                [DownloadTask(url, path)], [result])
+            local_path = task.path
+        spool.add(local_path, result.size)
+        if on_downloaded:
+            on_downloaded(path, local_path, result)
+        upload_queue.submit(UploadTask(local_path, remote_path_for(local_path),
+                                       result.md5, result.sha256))
+        return result
+
+    return download
+
+
+def write_archive(file, local_album_path, photos, archive_format, progress=None):
+    """Write photos into a ZIP / TAR archive on a non-seekable stream"""
+    if archive_format == 'zip':
+        # Photos are compressed already, storing them keeps this I/O bound
+        with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for done, photo_name in enumerate(photos, 1):
+                archive.write(os.path.join(local_album_path, photo_name), photo_name)
+                if progress:
+                    progress(done, len(photos))
+    else:
+        with tarfile.open(fileobj=file, mode='w|') as archive:
+            for done, photo_name in enumerate(photos, 1):
+                archive.add(os.path.join(local_album_path, photo_name), photo_name)
+                if progress:
+                    progress(done, len(photos))
+
+
+def stream_archive_to_yandex_disk(y, local_album_path, remote_archive_path, photos,
+                                  archive_format, progress=None):
+    """
+    Build an album archive on the fly and upload it as a single object
+
+    A writer thread packs the photos into one end of a pipe while Yandex Disk
+    reads the other end, so the archive is never staged on local disk.
+
+    Returns:
+        DownloadResult of the archive or False on failure
+    """
+    for attempt in range(upload_retries + 1):
+        read_fd, write_fd = os.pipe()
+        reader = HashingReader(os.fdopen(read_fd, 'rb'))
+        writer_errors = []
+
+        def produce():
+            try:
+                with os.fdopen(write_fd, 'wb') as pipe:
+                    write_archive(pipe, local_album_path, photos, archive_format, progress)
+            except Exception as e:
+                writer_errors.append(e)
+
+        writer = threading.Thread(target=produce, daemon=True)
+        writer.start()
+        try:
+            with metrics.yandex_upload_seconds.time():
+                # A consumed pipe can't be replayed, so retries rebuild the archive instead
+                y.upload(reader, remote_archive_path, overwrite=True, n_retries=0)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            # Unblocks the writer if the upload stopped reading early
+            reader.raw.close()
+            writer.join()
+
+        # A broken pipe only means the upload gave up, its own error says why
+        error = error or (writer_errors[0] if writer_errors else None)
+        if error is None:
+            result = reader.result()
+            metrics.transferred_bytes.inc(result.size, stage='yandex')
+            metrics.transfers.inc(stage='archive', status='ok')
+            return result
+        if attempt == upload_retries:
+            print(f'\nError uploading {remote_archive_path}: {error}')
+        else:
+            metrics.retries.inc(stage='archive')
+            time.sleep(upload_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    metrics.transfers.inc(stage='archive', status='failed')
+    return False
+
+
+def upload_album_archive(y, local_album_path, remote_album_path, photos, progress=None,
+                         state=None, archive_format=None):
+    """
+    Upload one local album folder as a single archive next to where its folder would be
+
+    The archive is skipped when the state store records every photo as already
+    uploaded into it; one new photo re-uploads the whole archive.
+
+    Returns:
+        (UPLOADED / SKIPPED / FAILED, remote archive path)
+    """
+    archive_format = archive_format or archive_mode
+    remote_archive_path = remote_album_path + archive_extensions[archive_format]
+    photos = sorted(photos)
+    local_paths = [os.path.join(local_album_path, photo_name) for photo_name in photos]
+
+    uploaded = state.uploaded_files(local_album_path) if state else {}
+    if uploaded and all(uploaded.get(path) == remote_archive_path for path in local_paths):
+        return SKIPPED, remote_archive_path
+
+    if not stream_archive_to_yandex_disk(y, local_album_path, remote_archive_path, photos,
+                                         archive_format, progress):
+        return FAILED, remote_archive_path
+    if state:
+        for path in local_paths:
+            state.mark_uploaded_by_path(path, remote_archive_path)
+    return UPLOADED, remote_archive_path
+
+
+def publish_album(y, remote_album_path):
+    """Publish album folder or archive and return its public link (None on failure)"""
+    try:
+        if not y.is_public(remote_album_path):
+            y.publish(remote_album_path)
+        meta = y.get_meta(remote_album_path)
+        return meta.public_url
+    except Exception:
+        return None
 
 
 def upload_albums_to_yandex_disk(yandex_disk_path='/VK_Albums'):
@@ -49,8 +300,13 @@ def upload_albums_to_yandex_disk(yandex_disk_path='/VK_Albums'):
     
     Args:
         yandex_disk_path: Path on Yandex Disk where albums will be uploaded (default: /VK_Albums)
+
+    Returns:
+        False if any album or photo failed to upload (it stays on local disk), else True
     """
     y = get_yandex_disk_client()
+    state = StateStore()
+    uploader = YandexUploader(y, content_index=state)
     
     # Check if local albums directory exists
     if not os.path.exists(path_to_downloaded_albums):
@@ -65,25 +321,25 @@ def upload_albums_to_yandex_disk(yandex_disk_path='/VK_Albums'):
     if not albums:
         print(f'No albums found in "{path_to_downloaded_albums}"')
         print('Please download some albums first using main.py')
-        return
+        return True
     
     print(f'Found {len(albums)} album(s) to upload')
     print(f'Uploading to Yandex Disk path: {yandex_disk_path}')
     print()
     
     # Create base directory on Yandex Disk if it doesn't exist
-    if not y.exists(yandex_disk_path):
-        print(f'Creating directory on Yandex Disk: {yandex_disk_path}')
-        y.mkdir(yandex_disk_path)
+    uploader.index.ensure_dir(yandex_disk_path)
     
     # Upload each album
+    failed_albums = []
     for album_name in albums:
         local_album_path = os.path.join(path_to_downloaded_albums, album_name)
         remote_album_path = f'{yandex_disk_path}/{album_name}'
         
         # Get list of photos in the album
         photos = [f for f in os.listdir(local_album_path) 
-                  if os.path.isfile(os.path.join(local_album_path, f))]
+                  if os.path.isfile(os.path.join(local_album_path, f))
+                  and not f.endswith(part_suffix)]
         
         if not photos:
             print(f'Skipping empty album: {album_name}')
@@ -91,47 +347,50 @@ def upload_albums_to_yandex_disk(yandex_disk_path='/VK_Albums'):
         
         print(f'Uploading album: {album_name} ({len(photos)} photos)')
         
-        # Create album directory on Yandex Disk if it doesn't exist
-        if not y.exists(remote_album_path):
-            y.mkdir(remote_album_path)
+        if archive_mode:
+            status, remote_archive_path = upload_album_archive(
+                y, local_album_path, remote_album_path, photos, print_progress, state)
+            print()
+            if status == SKIPPED:
+                print(f'⊘ Archive {remote_archive_path} is up to date')
+            elif status == FAILED:
+                print(f'✗ Failed to upload {remote_archive_path}')
+                failed_albums.append(album_name)
+                continue
+            else:
+                print(f'✓ Uploaded {len(photos)} photo(s) as {remote_archive_path}')
+            public_url = publish_album(y, remote_archive_path)
+            if public_url:
+                print(f'🔗 {public_url}')
+            print()
+            continue
         
-        # Upload each photo
-        uploaded_count = 0
-        skipped_count = 0
+        # Create album directory on Yandex Disk if it doesn't exist
+        uploader.index.ensure_dir(remote_album_path)
         
-        for i, photo_name in enumerate(photos, 1):
-            local_photo_path = os.path.join(local_album_path, photo_name)
-            remote_photo_path = f'{remote_album_path}/{photo_name}'
-            
-            # Check if photo already exists on Yandex Disk
-            if y.exists(remote_photo_path):
-                # Check if sizes match (to avoid re-uploading identical files)
-                local_size = os.path.getsize(local_photo_path)
-                remote_info = y.get_meta(remote_photo_path)
-                
-                if remote_info.size == local_size:
-                    skipped_count += 1
-                    print_progress(i, len(photos))
-                    continue
-            
-            # Upload photo
-            try:
-                y.upload(local_photo_path, remote_photo_path, overwrite=True)
-                uploaded_count += 1
-            except Exception as e:
-                print(f'\nError uploading {photo_name}: {e}')
-                continue
-            
-            print_progress(i, len(photos))
+        # Upload photos in parallel
+        stats = upload_album(uploader, local_album_path, remote_album_path, photos,
+                             print_progress, state)
+        uploaded_count = stats[UPLOADED]
+        skipped_count = stats[SKIPPED]
         
         print()
         if uploaded_count > 0:
             print(f'✓ Uploaded {uploaded_count} new photo(s)')
         if skipped_count > 0:
             print(f'⊘ Skipped {skipped_count} existing photo(s)')
+        if stats[DEDUPLICATED] > 0:
+            print(f'⧉ Copied {stats[DEDUPLICATED]} duplicate photo(s) already on the disk')
+        if stats[FAILED] > 0:
+            print(f'✗ Failed to upload {stats[FAILED]} photo(s)')
+            failed_albums.append(album_name)
         print()
     
+    if failed_albums:
+        print(f'✗ {len(failed_albums)} album(s) not uploaded completely: {", ".join(failed_albums)}')
+        return False
     print('All albums uploaded successfully!')
+    return True
 
 
 def main():
@@ -139,7 +398,8 @@ def main():
     # You can customize the Yandex Disk path here
     yandex_disk_path = os.getenv('YANDEX_DISK_PATH', '/VK_Albums')
     
-    upload_albums_to_yandex_disk(yandex_disk_path)
+    if not upload_albums_to_yandex_disk(yandex_disk_path):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import os
+import vk_api
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# VK returns at most 1000 photos per photos.get call
+photos_page_size = 1000
+# VK allows at most 25 API calls inside a single execute
+execute_max_calls = 25
+# photos.get pages packed into one execute call; every photo carries all its
+# sizes, so full 25 page responses get too large for VK
+photos_pages_per_execute = min(int(os.getenv('VK_PHOTOS_PAGES_PER_EXECUTE', '5')),
+                               execute_max_calls)
+# Runtime error in execute, e.g. "response size is too big"
+execute_runtime_error_code = 13
+
+# VKScript that fetches up to `pages` consecutive photos.get pages starting at `offset`
+list_photos_code = '''
+var owner_id = {owner_id};
+var album_id = {album_id};
+var offset = {offset};
+var count = offset + 1;
+var pages = [];
+var i = 0;
+while (i < {pages} && offset < count) {{
+    var response = API.photos.get({{"owner_id": owner_id, "album_id": album_id,
+                                    "photo_sizes": 1, "offset": offset,
+                                    "count": {page_size}}});
+    count = response.count;
+    pages.push(response.items);
+    offset = offset + {page_size};
+    i = i + 1;
+}}
+return {{"count": count, "pages": pages}};
+'''
+
+
+def list_album_photos(api, owner_id, album_id):
+    """
+    List all photos of an album, no matter how large it is
+
+    Up to photos_pages_per_execute pages of photos.get are fetched in a single
+    execute call, so a 10k photo album costs two API round trips. When VK finds
+    a response too large the pages per call are halved and the call repeated.
+
+    Raises:
+        vk_api.exceptions.ApiError: also when a photos.get inside execute failed
+    """
+    # raw=True keeps execute_errors, which api.execute(...) would drop
+    session = api._vk
+    photos = []
+    offset = 0
+    count = None
+    pages_per_call = photos_pages_per_execute
+    while count is None or offset < count:
+        values = {'code': list_photos_code.format(
+            owner_id=int(owner_id), album_id=int(album_id), offset=offset,
+            pages=pages_per_call, page_size=photos_page_size)}
+        try:
+            raw_response = session.method('execute', values, raw=True)
+        except vk_api.exceptions.ApiError as e:
+            if e.code != execute_runtime_error_code or pages_per_call == 1:
+                raise
+            pages_per_call //= 2
+            continue
+        if raw_response.get('execute_errors'):
+            raise vk_api.exceptions.ApiError(session, 'execute', values, True,
+                                             raw_response['execute_errors'][0])
+        response = raw_response['response']
+        pages = response['pages'] or []
+        if not isinstance(response['count'], int) or not all(
+                isinstance(page, list) for page in pages):
+            # A failed inner call leaves false / null in place of its result
+            raise vk_api.exceptions.ApiError(session, 'execute', values, True, {
+                'error_code': 0, 'error_msg': 'photos.get failed inside execute'})
+        count = response['count']
+        for page in pages:
+            photos.extend(page)
+        if not pages or not pages[-1]:
+            break
+        offset += len(pages) * photos_page_size
+    return photos
@@ -0,0 +1,109 @@
+import os
+import time
+import random
+import threading
+import contextlib
+import vk_api
+from dotenv import load_dotenv
+
+import metrics
+
+# Load environment variables
+load_dotenv()
+
+# VK allows 3 requests per second for a user token
+vk_requests_per_second = float(os.getenv('VK_REQUESTS_PER_SECOND', '3'))
+# Requests that may be sent back to back after an idle period
+vk_burst = int(os.getenv('VK_BURST', '3'))
+# How many times a throttled / failed VK call is retried
+vk_api_retries = int(os.getenv('VK_API_RETRIES', '5'))
+# Base delay in seconds between retries, doubled on every attempt
+vk_api_backoff = float(os.getenv('VK_API_BACKOFF', '0.5'))
+
+# 6 - too many requests per second, 10 - internal server error
+retryable_error_codes = (6, 10)
+too_many_requests_code = 6
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second on average"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Drop all saved tokens so every caller slows down to the base rate"""
+        with self._lock:
+            self._refill()
+            self._tokens = 0
+
+
+# One budget for the whole process, shared by every session and worker
+vk_bucket = TokenBucket(vk_requests_per_second, vk_burst)
+
+
+class RateLimitedVkApi(vk_api.VkApi):
+    """
+    VkApi that respects VK's request rate across all threads
+
+    Every call takes a token from the shared bucket, errors 6 / 10 are retried
+    with jittered exponential backoff.
+    """
+
+    # The bucket replaces vk_api's own delay, which also holds a lock for the
+    # whole request and would serialize concurrent workers
+    RPS_DELAY = 0
+
+    def __init__(self, *args, bucket=None, retries=None, backoff=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = contextlib.nullcontext()
+        self.bucket = bucket or vk_bucket
+        self.retries = vk_api_retries if retries is None else retries
+        self.backoff = vk_api_backoff if backoff is None else backoff
+        # vk_api's own handler sleeps and re-enters method() recursively; error 6
+        # has to reach the retry loop below instead
+        self.error_handlers.pop(too_many_requests_code, None)
+
+    def _call(self, method, values, *args, **kwargs):
+        response = super().method(method, values, *args, **kwargs)
+        if kwargs.get('raw') and method == 'execute':
+            # Throttling of a call inside execute is retried like a direct call
+            for error in response.get('execute_errors') or ():
+                if error.get('error_code') in retryable_error_codes:
+                    raise vk_api.exceptions.ApiError(self, method, values, True, error)
+        return response
+
+    def method(self, method, values=None, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                with metrics.vk_request_seconds.time(method=method):
+                    return self._call(method, values, *args, **kwargs)
+            except vk_api.exceptions.ApiError as e:
+                metrics.vk_errors.inc(code=e.code)
+                if e.code not in retryable_error_codes or attempt == self.retries:
+                    raise
+                metrics.retries.inc(stage='vk')
+                if e.code == too_many_requests_code:
+                    self.bucket.drain()
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
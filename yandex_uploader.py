@@ -0,0 +1,194 @@
+import os
+import time
+import posixpath
+import random
+import threading
+import yadisk
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+import metrics
+from remote_index import RemoteIndex
+from http_client import file_hashes
+
+# Load environment variables
+load_dotenv()
+
+# Number of files uploaded to Yandex Disk at the same time
+upload_workers = int(os.getenv('UPLOAD_WORKERS', '8'))
+# How many times a failed upload is retried
+upload_retries = int(os.getenv('UPLOAD_RETRIES', '3'))
+# Base delay in seconds between retries, doubled on every attempt
+upload_backoff = float(os.getenv('UPLOAD_BACKOFF', '1'))
+
+# md5 / sha256 are optional, they are computed from the file when missing
+UploadTask = namedtuple('UploadTask', ['local_path', 'remote_path', 'md5', 'sha256'],
+                        defaults=(None, None))
+
+UPLOADED = 'uploaded'
+SKIPPED = 'skipped'
+DEDUPLICATED = 'deduplicated'
+FAILED = 'failed'
+
+
+class YandexUploader:
+    """
+    Uploads files to Yandex Disk with a bounded worker pool and per-file retries
+
+    Skip decisions compare MD5 with the checksum Yandex Disk stores. With a
+    content_index (see StateStore) bytes that are already on the disk under
+    another path are copied server-side instead of being uploaded again.
+    """
+
+    def __init__(self, y, workers=None, retries=None, backoff=None, index=None,
+                 content_index=None):
+        self.y = y
+        self.index = index or RemoteIndex(y)
+        self.content_index = content_index
+        self.workers = workers or upload_workers
+        self.retries = upload_retries if retries is None else retries
+        self.backoff = upload_backoff if backoff is None else backoff
+        self._content_locks = {}
+        self._lock = threading.Lock()
+
+    def _content_lock(self, sha256):
+        """Serialize uploads of identical bytes so the second one becomes a copy"""
+        with self._lock:
+            return self._content_locks.setdefault(sha256, threading.Lock())
+
+    def _hashes(self, task):
+        if task.md5 and task.sha256:
+            return os.path.getsize(task.local_path), task.md5, task.sha256
+        return file_hashes(task.local_path)
+
+    def _is_uploaded(self, task, size, md5):
+        """Check if an identical file is already on Yandex Disk"""
+        remote = self.index.lookup(task.remote_path)
+        if remote is None:
+            return False
+        remote_size, remote_md5 = remote
+        # Sizes are only a fallback for entries without a stored checksum
+        return remote_md5 == md5 if remote_md5 else remote_size == size
+
+    def _copy_existing(self, sha256, task):
+        """Copy identical bytes that are already on Yandex Disk, True on success"""
+        source = self.content_index.find_content(sha256)
+        if not source or source == task.remote_path:
+            return False
+        try:
+            self.y.copy(source, task.remote_path, overwrite=True)
+            return True
+        except yadisk.exceptions.PathNotFoundError:
+            # The earlier copy was deleted, forget it and upload again
+            self.content_index.forget_content(sha256)
+        except Exception as e:
+            print(f'\nError copying {source}: {e}')
+        return False
+
+    def _upload_one(self, task):
+        size, md5, sha256 = self._hashes(task)
+        if self._is_uploaded(task, size, md5):
+            if self.content_index:
+                self.content_index.add_content(sha256, md5, size, task.remote_path)
+            return SKIPPED
+
+        with self._content_lock(sha256):
+            if self.content_index and self._copy_existing(sha256, task):
+                self.index.add(task.remote_path, size, md5)
+                return DEDUPLICATED
+
+            for attempt in range(self.retries + 1):
+                try:
+                    with metrics.yandex_upload_seconds.time():
+                        self.y.upload(task.local_path, task.remote_path, overwrite=True)
+                    metrics.transferred_bytes.inc(size, stage='yandex')
+                    self.index.add(task.remote_path, size, md5)
+                    if self.content_index:
+                        self.content_index.add_content(sha256, md5, size, task.remote_path)
+                    return UPLOADED
+                except Exception as e:
+                    if attempt == self.retries:
+                        print(f'\nError uploading {os.path.basename(task.local_path)}: {e}')
+                        return FAILED
+                    metrics.retries.inc(stage='yandex')
+                    # Exponential backoff with jitter so workers don't retry in lockstep
+                    time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        return FAILED
+
+    def upload_one(self, task):
+        """Upload a single task, returns its status and never raises"""
+        try:
+            status = self._upload_one(task)
+        except Exception as e:
+            print(f'\nError uploading: {e}')
+            status = FAILED
+        metrics.transfers.inc(stage='yandex', status=status)
+        return status
+
+    def upload(self, tasks, progress=None, on_result=None):
+        """
+        Upload all tasks concurrently
+
+        Args:
+            tasks: list of UploadTask
+            progress: optional callback progress(done, total), always called from
+                the calling thread with a strictly increasing done counter
+            on_result: optional callback on_result(task, status), called from the
+                calling thread as soon as a task finishes
+
+        Returns:
+            Counter with the number of UPLOADED / SKIPPED / DEDUPLICATED / FAILED files
+        """
+        stats = Counter()
+        if not tasks:
+            return stats
+
+        # List every target folder once up front instead of probing each file
+        for folder in {posixpath.dirname(task.remote_path) for task in tasks}:
+            self.index.listing(folder)
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.upload_one, task): task for task in tasks}
+            for future in as_completed(futures):
+                status = future.result()
+                stats[status] += 1
+                if on_result:
+                    on_result(futures[future], status)
+                done += 1
+                if progress:
+                    progress(done, len(tasks))
+        return stats
+
+
+class UploadQueue:
+    """
+    Uploads tasks as they are submitted, for producers that are still running
+
+    Unlike YandexUploader.upload, which needs the whole list up front, this
+    lets downloaders hand over each photo the moment it is on disk.
+    """
+
+    def __init__(self, uploader, on_result=None):
+        self.uploader = uploader
+        self.on_result = on_result
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=uploader.workers)
+
+    def submit(self, task):
+        future = self._executor.submit(self.uploader.upload_one, task)
+        future.add_done_callback(lambda f: self._finished(task, f.result()))
+
+    def _finished(self, task, status):
+        with self._lock:
+            self.stats[status] += 1
+        if self.on_result:
+            # Runs on the upload worker thread
+            self.on_result(task, status)
+
+    def close(self):
+        """Wait for every submitted upload, returns Counter like YandexUploader.upload"""
+        self._executor.shutdown(wait=True)
+        return self.stats